@@ -0,0 +1,317 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+
+import game4
+import game5
+import game6
+
+FPS = 60
+WIDTH = 1280
+HEIGHT = 720
+PHASES = ("spawn", "move", "collision", "cleanup")
+
+SCENARIOS = {
+    "idle": {"npcs": 0, "bullets_per_tick": 0, "coins": 0, "move": False},
+    "npcs_1k": {"npcs": 1000, "bullets_per_tick": 0, "coins": 0, "move": False},
+    "bullet_storm": {"npcs": 200, "bullets_per_tick": 20, "coins": 0, "move": False},
+    "coin_farm": {"npcs": 0, "bullets_per_tick": 0, "coins": 200, "move": True},
+}
+
+
+class Keys:
+    def __init__(self, pressed=()):
+        self.pressed = set(pressed)
+
+    def __getitem__(self, key):
+        return key in self.pressed
+
+
+NO_KEYS = Keys()
+# player walks a square so coin_farm keeps sweeping up coins
+WALK_KEYS = [Keys([pygame.K_d]), Keys([pygame.K_s]), Keys([pygame.K_a]), Keys([pygame.K_w])]
+
+
+class Game6Runner:
+    name = "game6"
+    engine_class = game6.GameEngine
+    supports_bullets = True
+    supports_coins = True
+
+    def __init__(self, seed, scenario):
+        self.limits = {"MAX_NPCS": max(game6.MAX_NPCS, scenario["npcs"]),
+                       "MAX_COINS": max(game6.MAX_COINS, scenario["coins"])}
+        self.saved = {name: getattr(game6, name) for name in self.limits}
+        for name, value in self.limits.items():
+            setattr(game6, name, value)
+        self.engine = game6.make_headless_engine(seed, width=WIDTH, height=HEIGHT, fps=FPS,
+                                                 engine_class=self.engine_class)
+        # benchmarks measure steady-state tick cost, so the player never dies
+        self.engine.player.lives = float('inf')
+        for _ in range(scenario["npcs"]):
+            self.engine.spawn_npc_random()
+        for _ in range(scenario["coins"]):
+            self.engine.spawn_coin()
+
+    def close(self):
+        for name, value in self.saved.items():
+            setattr(game6, name, value)
+
+    def now(self):
+        return self.engine.clock.get_ticks()
+
+    def advance(self):
+        self.engine.clock.tick(FPS)
+
+    def fire(self, count, tick):
+        player = self.engine.player
+        for i in range(count):
+            player.angle = (tick * 7 + i * 360 / count) % 360
+            self.engine.fire_bullet()
+
+    def spawn(self, now):
+        self.engine.spawn_entities(now)
+
+    def move(self, keys):
+        self.engine.move_entities(keys)
+
+    def collide(self):
+        return self.engine.find_collisions()
+
+    def cleanup(self, hits, now):
+        self.engine.remove_collided(hits, now)
+
+    def counts(self):
+        return {"npcs": len(self.engine.npcs), "bullets": len(self.engine.bullets),
+                "coins": len(self.engine.coins), "score": self.engine.score}
+
+
+class PooledGame6Runner(Game6Runner):
+    name = "game6_pooled"
+    engine_class = game6.PooledGameEngine
+
+
+class Game5Runner:
+    name = "game5"
+    supports_bullets = False
+    supports_coins = True
+
+    def __init__(self, seed, scenario):
+        random.seed(seed)
+        self.limits = {"MAX_ENEMIES": max(game5.MAX_ENEMIES, scenario["npcs"]),
+                       "MAX_COINS": max(game5.MAX_COINS, scenario["coins"])}
+        self.saved = {name: getattr(game5, name) for name in self.limits}
+        for name, value in self.limits.items():
+            setattr(game5, name, value)
+        field = game5.GameField(0, 0, WIDTH, HEIGHT)
+        self.engine = game5.GameEngine(None, field, game5.Player(WIDTH / 2, HEIGHT / 2, speed=10), fps=FPS)
+        self.engine.player.lives = float('inf')
+        self.ticks = 0.0
+        for _ in range(scenario["npcs"]):
+            self.engine.spawn_enemy()
+        for _ in range(scenario["coins"]):
+            self.engine.spawn_coin()
+
+    def close(self):
+        for name, value in self.saved.items():
+            setattr(game5, name, value)
+
+    def now(self):
+        return int(self.ticks)
+
+    def advance(self):
+        self.ticks += 1000 / FPS
+
+    def spawn(self, now):
+        self.engine.spawn_entities(now)
+
+    def move(self, keys):
+        self.engine.move_entities(keys)
+
+    def collide(self):
+        return self.engine.find_collisions()
+
+    def cleanup(self, hits, now):
+        self.engine.remove_collided(hits, now)
+
+    def counts(self):
+        return {"npcs": len(self.engine.enemies), "bullets": 0,
+                "coins": len(self.engine.coins), "score": self.engine.score}
+
+
+class Game4Runner:
+    name = "game4"
+    supports_bullets = True
+    supports_coins = False
+
+    def __init__(self, seed, scenario):
+        random.seed(seed)
+        self.limits = {"MAX_NPCS": max(game4.MAX_NPCS, scenario["npcs"])}
+        self.saved = {name: getattr(game4, name) for name in self.limits}
+        for name, value in self.limits.items():
+            setattr(game4, name, value)
+        field = game4.GameField(0, 0, WIDTH, HEIGHT)
+        player = game4.Player(WIDTH / 2, HEIGHT / 2, speed_x=8, speed_y=8)
+        self.engine = game4.GameEngine(None, field, player, [game4.NPC(100, 100, 3, 3)], fps=FPS)
+        self.engine.last_spawn_time = 0
+        self.ticks = 0.0
+        for _ in range(scenario["npcs"]):
+            self.engine.spawn_npc()
+
+    def close(self):
+        for name, value in self.saved.items():
+            setattr(game4, name, value)
+
+    def now(self):
+        return int(self.ticks)
+
+    def advance(self):
+        self.ticks += 1000 / FPS
+
+    def fire(self, count, tick):
+        player = self.engine.player
+        for i in range(count):
+            player.angle = (tick * 7 + i * 360 / count) % 360
+            dir_x, dir_y = player.get_direction()
+            self.engine.bullets.append(game4.Bullet(player.x + dir_x * 25, player.y + dir_y * 25,
+                                                    dir_x, dir_y, speed=15))
+
+    def spawn(self, now):
+        self.engine.spawn_entities(now)
+
+    def move(self, keys):
+        self.engine.move_entities(keys)
+
+    def collide(self):
+        return self.engine.find_collisions()
+
+    def cleanup(self, hits, now):
+        self.engine.remove_collided(hits)
+
+    def counts(self):
+        return {"npcs": len(self.engine.npcs), "bullets": len(self.engine.bullets),
+                "coins": 0, "score": 0}
+
+
+RUNNERS = {runner.name: runner for runner in (Game6Runner, PooledGame6Runner, Game5Runner, Game4Runner)}
+
+
+def supports(runner_class, scenario):
+    if scenario["bullets_per_tick"] and not runner_class.supports_bullets:
+        return False
+    if scenario["coins"] and not runner_class.supports_coins:
+        return False
+    return True
+
+
+def run_ticks(runner, scenario, ticks, timings=None):
+    for tick in range(ticks):
+        keys = WALK_KEYS[(tick // 30) % len(WALK_KEYS)] if scenario["move"] else NO_KEYS
+        if scenario["bullets_per_tick"]:
+            runner.fire(scenario["bullets_per_tick"], tick)
+        now = runner.now()
+
+        t0 = time.perf_counter()
+        runner.spawn(now)
+        t1 = time.perf_counter()
+        runner.move(keys)
+        t2 = time.perf_counter()
+        hits = runner.collide()
+        t3 = time.perf_counter()
+        runner.cleanup(hits, now)
+        t4 = time.perf_counter()
+        runner.advance()
+
+        if timings is not None:
+            for phase, elapsed in zip(PHASES, (t1 - t0, t2 - t1, t3 - t2, t4 - t3)):
+                timings[phase].append(elapsed)
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    total = sum(samples)
+    return {"total_ms": total * 1e3,
+            "mean_us": total / len(samples) * 1e6,
+            "p95_us": samples[int(len(samples) * 0.95)] * 1e6,
+            "max_us": samples[-1] * 1e6}
+
+
+def bench(runner_class, scenario_name, ticks, seed):
+    scenario = SCENARIOS[scenario_name]
+
+    runner = runner_class(seed, scenario)
+    timings = {phase: [] for phase in PHASES}
+    try:
+        start = time.perf_counter()
+        run_ticks(runner, scenario, ticks, timings)
+        elapsed = time.perf_counter() - start
+        final = runner.counts()
+    finally:
+        runner.close()
+
+    # second pass with the same seed: tracemalloc slows everything down, so
+    # it is kept out of the timed run
+    runner = runner_class(seed, scenario)
+    try:
+        tracemalloc.start()
+        run_ticks(runner, scenario, ticks)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        runner.close()
+
+    return {"engine": runner_class.name,
+            "scenario": scenario_name,
+            "ticks": ticks,
+            "seed": seed,
+            "ticks_per_sec": ticks / elapsed,
+            "phases": {phase: summarize(samples) for phase, samples in timings.items()},
+            "peak_memory_bytes": peak,
+            "final": final}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless tick benchmarks for game4/game5/game6")
+    parser.add_argument("--ticks", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--engines", default=",".join(RUNNERS))
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--out", default="bench_results.json")
+    args = parser.parse_args()
+
+    results = []
+    for engine_name in args.engines.split(","):
+        runner_class = RUNNERS[engine_name]
+        for scenario_name in args.scenarios.split(","):
+            if not supports(runner_class, SCENARIOS[scenario_name]):
+                print(f"{engine_name:13s} {scenario_name:13s} skipped (not supported by this engine)")
+                continue
+            result = bench(runner_class, scenario_name, args.ticks, args.seed)
+            results.append(result)
+            phases = "  ".join(f"{phase} {result['phases'][phase]['mean_us']:8.1f}us" for phase in PHASES)
+            print(f"{engine_name:13s} {scenario_name:13s} {result['ticks_per_sec']:10.0f} ticks/s  {phases}  "
+                  f"peak {result['peak_memory_bytes'] / 1024:.0f} KiB")
+
+    report = {"meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "python": sys.version.split()[0],
+                       "platform": platform.platform(),
+                       "fps": FPS,
+                       "field": [WIDTH, HEIGHT]},
+              "results": results}
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
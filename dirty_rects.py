@@ -0,0 +1,49 @@
+import pygame
+
+# above this fraction of the screen a single flip is cheaper than many small updates
+FULL_FLIP_RATIO = 0.4
+
+
+class DirtyRectRenderer:
+    def __init__(self, screen, background_color, full_flip_ratio=FULL_FLIP_RATIO):
+        self.screen = screen
+        self.bounds = screen.get_rect()
+        self.background = pygame.Surface(screen.get_size()).convert()
+        self.background.fill(background_color)
+        self.full_flip_area = self.bounds.width * self.bounds.height * full_flip_ratio
+        self.previous = []
+        self.current = []
+        self.full_redraw = True
+
+    def invalidate(self):
+        self.full_redraw = True
+
+    def start_frame(self):
+        # erase only what was drawn last frame
+        if self.full_redraw:
+            self.screen.blit(self.background, (0, 0))
+        else:
+            for rect in self.previous:
+                self.screen.blit(self.background, rect, rect)
+
+    def add(self, rect):
+        rect = rect.clip(self.bounds)
+        if rect.width and rect.height:
+            self.current.append(rect)
+
+    def blit(self, surface, dest):
+        self.add(self.screen.blit(surface, dest))
+
+    def blits(self, blit_sequence):
+        for rect in self.screen.blits(blit_sequence):
+            self.add(rect)
+
+    def show_frame(self):
+        dirty = self.previous + self.current
+        if self.full_redraw or sum(rect.width * rect.height for rect in dirty) > self.full_flip_area:
+            pygame.display.flip()
+        elif dirty:
+            pygame.display.update(dirty)
+        self.previous = self.current
+        self.current = []
+        self.full_redraw = False
@@ -139,42 +139,11 @@ class GameEngine:
             self.bullets.append(Bullet(bullet_x, bullet_y, dir_x, dir_y, speed=15))
             self.last_fire_time = current_time
 
-    def update_bullets(self):
-        bullets_to_remove = []
-        npcs_to_remove = []
-        for bullet in self.bullets:
-            bullet.move()
-            if bullet.is_outside(self.game_field):
-                bullets_to_remove.append(bullet)
-                continue
-            for npc in self.npcs:
-                if bullet.hits(npc):
-                    bullets_to_remove.append(bullet)
-                    npcs_to_remove.append(npc)
-                    break
-        for bullet in bullets_to_remove:
-            if bullet in self.bullets:
-                self.bullets.remove(bullet)
-        for npc in npcs_to_remove:
-            if npc in self.npcs:
-                self.npcs.remove(npc)
-
     def update_state(self, keys):
         current_time = pygame.time.get_ticks()
-        if current_time - self.last_spawn_time >= NPC_SPAWN_INTERVAL:
-            self.spawn_npc()
-            self.last_spawn_time = current_time
-
-        for npc in self.npcs:
-            npc.move(self.game_field)
-
-        self.player.move(keys[pygame.K_a], keys[pygame.K_d], keys[pygame.K_w], keys[pygame.K_s], self.game_field)
-        self.player.rotate(keys[pygame.K_LEFT], keys[pygame.K_RIGHT])
-
-        if keys[pygame.K_SPACE]:
-            self.fire_bullet()
-
-        self.update_bullets()
+        self.spawn_entities(current_time)
+        self.move_entities(keys)
+        self.resolve_collisions()
 
         if len(self.npcs) == 0:
             text_surface = font.render('YOU WIN', True, (255, 255, 255))
@@ -197,6 +166,50 @@ class GameEngine:
         if keys[pygame.K_q]:
             self.running = False
 
+    def spawn_entities(self, current_time):
+        if current_time - self.last_spawn_time >= NPC_SPAWN_INTERVAL:
+            self.spawn_npc()
+            self.last_spawn_time = current_time
+
+    def move_entities(self, keys):
+        for npc in self.npcs:
+            npc.move(self.game_field)
+
+        self.player.move(keys[pygame.K_a], keys[pygame.K_d], keys[pygame.K_w], keys[pygame.K_s], self.game_field)
+        self.player.rotate(keys[pygame.K_LEFT], keys[pygame.K_RIGHT])
+
+        if keys[pygame.K_SPACE]:
+            self.fire_bullet()
+
+        for bullet in self.bullets:
+            bullet.move()
+
+    def resolve_collisions(self):
+        self.remove_collided(self.find_collisions())
+
+    def find_collisions(self):
+        bullets_to_remove = []
+        npcs_to_remove = []
+        for bullet in self.bullets:
+            if bullet.is_outside(self.game_field):
+                bullets_to_remove.append(bullet)
+                continue
+            for npc in self.npcs:
+                if bullet.hits(npc):
+                    bullets_to_remove.append(bullet)
+                    npcs_to_remove.append(npc)
+                    break
+        return bullets_to_remove, npcs_to_remove
+
+    def remove_collided(self, hits):
+        bullets_to_remove, npcs_to_remove = hits
+        for bullet in bullets_to_remove:
+            if bullet in self.bullets:
+                self.bullets.remove(bullet)
+        for npc in npcs_to_remove:
+            if npc in self.npcs:
+                self.npcs.remove(npc)
+
     def render_state(self):
         self.graph_engine.start_frame()
         self.graph_engine.render_player(self.player.x, self.player.y, 20, self.player.angle, 'green')
@@ -146,7 +146,16 @@ class GameEngine:
             return
 
         current_time = pygame.time.get_ticks()
+        self.spawn_entities(current_time)
+        self.move_entities(keys)
+        self.resolve_collisions(current_time)
+        if self.game_over:
+            return
+
+        if keys[pygame.K_q]:
+            self.running = False
 
+    def spawn_entities(self, current_time):
         if current_time - self.last_enemy_spawn >= ENEMY_SPAWN_INTERVAL:
             self.spawn_enemy()
             self.last_enemy_spawn = current_time
@@ -155,6 +164,7 @@ class GameEngine:
             self.spawn_coin()
             self.last_coin_spawn = current_time
 
+    def move_entities(self, keys):
         self.player.move(
             keys[pygame.K_a] or keys[pygame.K_LEFT],
             keys[pygame.K_d] or keys[pygame.K_RIGHT],
@@ -166,20 +176,26 @@ class GameEngine:
         for enemy in self.enemies:
             enemy.move(self.game_field)
 
-        for coin in self.coins[:]:
-            if self.player.collides_with(coin):
-                self.score += 10
-                self.coins.remove(coin)
-
-        for enemy in self.enemies[:]:
-            if self.player.collides_with(enemy):
-                if self.player.take_hit(current_time):
-                    self.game_over = True
-                    return
-                self.enemies.remove(enemy)
-
-        if keys[pygame.K_q]:
-            self.running = False
+    def resolve_collisions(self, current_time):
+        hits = self.find_collisions()
+        self.remove_collided(hits, current_time)
+
+    def find_collisions(self):
+        coin_hits = [coin for coin in self.coins if self.player.collides_with(coin)]
+        enemy_hits = [enemy for enemy in self.enemies if self.player.collides_with(enemy)]
+        return coin_hits, enemy_hits
+
+    def remove_collided(self, hits, current_time):
+        coin_hits, enemy_hits = hits
+        for coin in coin_hits:
+            self.score += 10
+            self.coins.remove(coin)
+
+        for enemy in enemy_hits:
+            if self.player.take_hit(current_time):
+                self.game_over = True
+                return
+            self.enemies.remove(enemy)
 
     def render_state(self):
         current_time = pygame.time.get_ticks()
@@ -1,9 +1,12 @@
 import math
+from collections import OrderedDict
+import numpy as np
 import pygame
 import random
+import sys
+import time
 
-pygame.font.init()
-font = pygame.font.SysFont('Arial', 32)
+from dirty_rects import DirtyRectRenderer
 
 NPC_SPAWN_INTERVAL = 2000
 COIN_SPAWN_INTERVAL = 3000
@@ -11,14 +14,22 @@ MAX_NPCS = 15
 MAX_COINS = 3
 BULLET_SPEED = 15
 ROTATION_SPEED = 5
+# must be at least the largest sum of two colliding radii (player + npc)
+CELL_SIZE = 64
+SIM_RATE = 60
+MAX_CATCHUP_STEPS = 5
+# player sprites are cached per this many degrees of barrel rotation
+ANGLE_BUCKET = ROTATION_SPEED
+TEXT_CACHE_SIZE = 64
 
 
 class GameField:
-    def __init__(self, x_min, y_min, x_max, y_max):
+    def __init__(self, x_min, y_min, x_max, y_max, rng=random):
         self.x_min = x_min
         self.y_min = y_min
         self.x_max = x_max
         self.y_max = y_max
+        self.rng = rng
 
     def clamp(self, x, y):
         clamped_x = max(self.x_min, min(self.x_max, x))
@@ -31,24 +42,27 @@ class GameField:
         return x < self.x_min or x > self.x_max or y < self.y_min or y > self.y_max
 
     def random_edge_pos(self):
-        edge = random.randint(0, 3)
+        edge = self.rng.randint(0, 3)
         if edge == 0:
-            return random.randint(self.x_min, self.x_max), self.y_min
+            return self.rng.randint(self.x_min, self.x_max), self.y_min
         elif edge == 1:
-            return self.x_max, random.randint(self.y_min, self.y_max)
+            return self.x_max, self.rng.randint(self.y_min, self.y_max)
         elif edge == 2:
-            return random.randint(self.x_min, self.x_max), self.y_max
+            return self.rng.randint(self.x_min, self.x_max), self.y_max
         else:
-            return self.x_min, random.randint(self.y_min, self.y_max)
+            return self.x_min, self.rng.randint(self.y_min, self.y_max)
 
     def random_coin_pos(self):
-        return random.randint(self.x_min + 100, self.x_max - 100), random.randint(self.y_min + 100, self.y_max - 100)
+        return (self.rng.randint(self.x_min + 100, self.x_max - 100),
+                self.rng.randint(self.y_min + 100, self.y_max - 100))
 
 
 class Player:
     def __init__(self, x, y, speed=10):
         self.x = x
         self.y = y
+        self.prev_x = x
+        self.prev_y = y
         self.speed = speed
         self.radius = 20
         self.lives = 3
@@ -91,6 +105,8 @@ class NPC:
     def __init__(self, x, y, speed_x, speed_y):
         self.x = x
         self.y = y
+        self.prev_x = x
+        self.prev_y = y
         self.speed_x = speed_x
         self.speed_y = speed_y
         self.radius = 18
@@ -109,6 +125,8 @@ class Bullet:
     def __init__(self, x, y, vx, vy):
         self.x = x
         self.y = y
+        self.prev_x = x
+        self.prev_y = y
         self.vx = vx
         self.vy = vy
         self.radius = 5
@@ -129,17 +147,82 @@ class Coin:
         self.radius = 12
 
 
+def interpolate(obj, alpha):
+    return obj.prev_x + (obj.x - obj.prev_x) * alpha, obj.prev_y + (obj.y - obj.prev_y) * alpha
+
+
+class SpatialHash:
+    def __init__(self, game_field, cell_size=CELL_SIZE):
+        self.game_field = game_field
+        self.cell_size = cell_size
+        self.cells = {}
+
+    def cell_of(self, x, y):
+        return (int((x - self.game_field.x_min) // self.cell_size),
+                int((y - self.game_field.y_min) // self.cell_size))
+
+    def rebuild(self, objects):
+        self.cells.clear()
+        for idx, obj in enumerate(objects):
+            self.cells.setdefault(self.cell_of(obj.x, obj.y), []).append((idx, obj))
+
+    def candidates(self, x, y):
+        cx, cy = self.cell_of(x, y)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                bucket = self.cells.get((cx + dx, cy + dy))
+                if bucket:
+                    yield from bucket
+
+
+class PygameClock:
+    def __init__(self):
+        self.clock = pygame.time.Clock()
+
+    def get_ticks(self):
+        return pygame.time.get_ticks()
+
+    def tick(self, fps):
+        return self.clock.tick(fps)
+
+
+class SimulatedClock:
+    def __init__(self):
+        self.ticks = 0.0
+
+    def get_ticks(self):
+        return int(self.ticks)
+
+    def tick(self, fps):
+        self.ticks += 1000 / fps
+        return 1000 // fps
+
+
+class NoKeys:
+    def __getitem__(self, key):
+        return False
+
+
+NO_KEYS = NoKeys()
+
+
 class GameEngine:
-    def __init__(self, graph_engine, game_field, player, *, fps=60):
+    def __init__(self, graph_engine, game_field, player, *, fps=60, clock=None, rng=random,
+                 sim_rate=SIM_RATE, max_catchup_steps=MAX_CATCHUP_STEPS):
         self.graph_engine = graph_engine
         self.game_field = game_field
         self.player = player
         self.npcs = []
         self.bullets = []
         self.coins = []
+        self.npc_grid = SpatialHash(game_field)
+        self.coin_grid = SpatialHash(game_field)
         self.score = 0
         self.fps = fps
-        self.clock = pygame.time.Clock()
+        self.clock = clock if clock is not None else PygameClock()
+        self.rng = rng
+        self.sim_rate = sim_rate
+        self.max_catchup_steps = max_catchup_steps
         self.last_npc_spawn = 0
         self.last_coin_spawn = 0
         self.running = False
@@ -148,8 +231,8 @@ class GameEngine:
     def spawn_npc_at(self, x, y):
         if len(self.npcs) >= MAX_NPCS:
             return
-        speed_x = random.choice([-1, 1]) * random.randint(2, 5)
-        speed_y = random.choice([-1, 1]) * random.randint(2, 5)
+        speed_x = self.rng.choice([-1, 1]) * self.rng.randint(2, 5)
+        speed_y = self.rng.choice([-1, 1]) * self.rng.randint(2, 5)
         self.npcs.append(NPC(x, y, speed_x, speed_y))
 
     def spawn_npc_random(self):
@@ -164,6 +247,9 @@ class GameEngine:
         x, y = self.game_field.random_coin_pos()
         self.coins.append(Coin(x, y))
 
+    def fire_bullet(self):
+        self.bullets.append(self.player.fire())
+
     def handle_events(self):
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
@@ -172,14 +258,17 @@ class GameEngine:
                 if event.key == pygame.K_r and self.game_over:
                     self.restart()
                 elif event.key == pygame.K_SPACE and not self.game_over:
-                    self.bullets.append(self.player.fire())
+                    self.fire_bullet()
             elif event.type == pygame.MOUSEBUTTONDOWN:
                 if event.button == 1 and not self.game_over:
                     self.spawn_npc_at(event.pos[0], event.pos[1])
+            elif event.type in (pygame.WINDOWEXPOSED, pygame.VIDEOEXPOSE):
+                # the window manager may have wiped parts we would not redraw
+                self.graph_engine.invalidate()
 
     def restart(self):
-        self.player.x = self.game_field.x_max / 2
-        self.player.y = self.game_field.y_max / 2
+        self.player.x = self.player.prev_x = self.game_field.x_max / 2
+        self.player.y = self.player.prev_y = self.game_field.y_max / 2
         self.player.lives = 3
         self.player.invincible_until = 0
         self.player.angle = 0
@@ -188,13 +277,23 @@ class GameEngine:
         self.coins.clear()
         self.score = 0
         self.game_over = False
+        self.graph_engine.invalidate()
 
     def update_state(self, keys):
         if self.game_over:
             return
 
-        current_time = pygame.time.get_ticks()
+        current_time = self.clock.get_ticks()
+        self.spawn_entities(current_time)
+        self.move_entities(keys)
+        self.resolve_collisions(current_time)
+        if self.game_over:
+            return
+
+        if keys[pygame.K_ESCAPE]:
+            self.running = False
 
+    def spawn_entities(self, current_time):
         if current_time - self.last_npc_spawn >= NPC_SPAWN_INTERVAL:
             self.spawn_npc_random()
             self.last_npc_spawn = current_time
@@ -203,6 +302,7 @@ class GameEngine:
             self.spawn_coin()
             self.last_coin_spawn = current_time
 
+    def move_entities(self, keys):
         self.player.move(
             keys[pygame.K_a] or keys[pygame.K_LEFT],
             keys[pygame.K_d] or keys[pygame.K_RIGHT],
@@ -219,57 +319,71 @@ class GameEngine:
         for bullet in self.bullets:
             bullet.move()
 
-        bullets_to_remove = []
-        npcs_to_remove = []
-        for bullet in self.bullets:
-            if self.game_field.is_outside(bullet.x, bullet.y):
-                bullets_to_remove.append(bullet)
-                continue
-            for npc in self.npcs:
-                if npc not in npcs_to_remove and bullet.collides_with(npc):
-                    bullets_to_remove.append(bullet)
-                    npcs_to_remove.append(npc)
-                    self.score += 5
-                    break
-
-        for bullet in bullets_to_remove:
-            if bullet in self.bullets:
-                self.bullets.remove(bullet)
-        for npc in npcs_to_remove:
-            if npc in self.npcs:
-                self.npcs.remove(npc)
-
-        for coin in self.coins[:]:
-            if self.player.collides_with(coin):
-                self.score += 10
-                self.coins.remove(coin)
-
-        for npc in self.npcs[:]:
-            if self.player.collides_with(npc):
-                if self.player.take_hit(current_time):
-                    self.game_over = True
-                    return
-                self.npcs.remove(npc)
+    def resolve_collisions(self, current_time):
+        hits = self.find_collisions()
+        self.remove_collided(hits, current_time)
 
-        if keys[pygame.K_ESCAPE]:
-            self.running = False
+    def find_collisions(self):
+        self.npc_grid.rebuild(self.npcs)
+        self.coin_grid.rebuild(self.coins)
 
-    def render_state(self):
-        current_time = pygame.time.get_ticks()
+        # candidates come from neighbouring cells in arbitrary order, so the
+        # lowest list index wins to match a linear scan over self.npcs
+        bullets_to_remove = set()
+        npcs_to_remove = set()
+        for bullet_idx, bullet in enumerate(self.bullets):
+            if self.game_field.is_outside(bullet.x, bullet.y):
+                bullets_to_remove.add(bullet_idx)
+                continue
+            hit_idx = None
+            for npc_idx, npc in self.npc_grid.candidates(bullet.x, bullet.y):
+                if ((hit_idx is None or npc_idx < hit_idx) and npc_idx not in npcs_to_remove
+                        and bullet.collides_with(npc)):
+                    hit_idx = npc_idx
+            if hit_idx is not None:
+                bullets_to_remove.add(bullet_idx)
+                npcs_to_remove.add(hit_idx)
+                self.score += 5
+
+        player_hits = [npc for npc_idx, npc in sorted(self.npc_grid.candidates(self.player.x, self.player.y))
+                       if npc_idx not in npcs_to_remove and self.player.collides_with(npc)]
+        coin_hits = {coin_idx for coin_idx, coin in self.coin_grid.candidates(self.player.x, self.player.y)
+                     if self.player.collides_with(coin)}
+        return bullets_to_remove, npcs_to_remove, coin_hits, player_hits
+
+    def remove_collided(self, hits, current_time):
+        bullets_to_remove, npcs_to_remove, coin_hits, player_hits = hits
+        if bullets_to_remove:
+            self.bullets[:] = [b for idx, b in enumerate(self.bullets) if idx not in bullets_to_remove]
+        if npcs_to_remove:
+            self.npcs[:] = [n for idx, n in enumerate(self.npcs) if idx not in npcs_to_remove]
+
+        if coin_hits:
+            self.score += 10 * len(coin_hits)
+            self.coins[:] = [c for idx, c in enumerate(self.coins) if idx not in coin_hits]
+
+        for npc in player_hits:
+            if self.player.take_hit(current_time):
+                self.game_over = True
+                return
+            self.npcs.remove(npc)
+
+    def save_positions(self):
+        for obj in (self.player, *self.npcs, *self.bullets):
+            obj.prev_x = obj.x
+            obj.prev_y = obj.y
+
+    def render_state(self, alpha=1.0):
+        # alpha is how far we are between the previous and the current
+        # simulation step; 1.0 draws the current state as is
+        current_time = self.clock.get_ticks()
         self.graph_engine.start_frame()
-
-        for coin in self.coins:
-            self.graph_engine.render_coin(coin.x, coin.y, coin.radius)
-
-        for npc in self.npcs:
-            self.graph_engine.render_npc(npc.x, npc.y, npc.radius)
-
-        for bullet in self.bullets:
-            self.graph_engine.render_bullet(bullet.x, bullet.y, bullet.radius)
+        self.render_entities(alpha)
 
         show_player = not self.player.is_invincible(current_time) or (current_time // 100) % 2 == 0
         if show_player:
-            self.graph_engine.render_player(self.player.x, self.player.y, self.player.radius, self.player.angle)
+            x, y = interpolate(self.player, alpha)
+            self.graph_engine.render_player(x, y, self.player.radius, self.player.angle)
 
         self.graph_engine.render_hud(self.score, self.player.lives)
 
@@ -278,16 +392,322 @@ class GameEngine:
 
         self.graph_engine.show_frame()
 
+    def render_entities(self, alpha=1.0):
+        for coin in self.coins:
+            self.graph_engine.render_coin(coin.x, coin.y, coin.radius)
+
+        for npc in self.npcs:
+            x, y = interpolate(npc, alpha)
+            self.graph_engine.render_npc(x, y, npc.radius)
+
+        for bullet in self.bullets:
+            x, y = interpolate(bullet, alpha)
+            self.graph_engine.render_bullet(x, y, bullet.radius)
+
     def run_game(self):
+        # the simulation advances in fixed 1 / sim_rate steps no matter how
+        # fast frames are drawn; fps only caps the render rate
         self.running = True
+        step_ms = 1000 / self.sim_rate
+        accumulator = 0.0
+        last_time = self.clock.get_ticks()
         while self.running:
             self.handle_events()
             keys = pygame.key.get_pressed()
-            self.update_state(keys)
-            self.render_state()
+
+            now = self.clock.get_ticks()
+            accumulator += now - last_time
+            last_time = now
+            steps = 0
+            while accumulator >= step_ms and steps < self.max_catchup_steps:
+                self.save_positions()
+                self.update_state(keys)
+                accumulator -= step_ms
+                steps += 1
+            if steps == self.max_catchup_steps:
+                # too far behind: drop the backlog instead of spiralling
+                accumulator = min(accumulator, step_ms)
+
+            self.render_state(accumulator / step_ms)
             self.clock.tick(self.fps)
         pygame.quit()
 
+    def run_headless(self, ticks, inputs=None, render=False):
+        # steps the simulation as fast as possible; pair with a
+        # SimulatedClock so spawn timers advance by 1000 / fps per tick
+        self.running = True
+        steps = 0
+        start = time.perf_counter()
+        while steps < ticks and self.running:
+            self.update_state(inputs(steps) if inputs else NO_KEYS)
+            if render:
+                self.render_state()
+            self.clock.tick(self.fps)
+            steps += 1
+        elapsed = time.perf_counter() - start
+        return steps / elapsed if elapsed > 0 else float('inf')
+
+
+class EntityPool:
+    def __init__(self, radius, capacity=64):
+        self.default_radius = radius
+        self.count = 0
+        self.x = np.zeros(capacity)
+        self.y = np.zeros(capacity)
+        self.prev_x = np.zeros(capacity)
+        self.prev_y = np.zeros(capacity)
+        self.vx = np.zeros(capacity)
+        self.vy = np.zeros(capacity)
+        self.radius = np.zeros(capacity)
+        self.alive = np.zeros(capacity, dtype=bool)
+
+    def __len__(self):
+        return self.count
+
+    def _grow(self):
+        capacity = len(self.x) * 2
+        for name in ("x", "y", "prev_x", "prev_y", "vx", "vy", "radius", "alive"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def add(self, x, y, vx, vy):
+        if self.count == len(self.x):
+            self._grow()
+        i = self.count
+        self.x[i] = self.prev_x[i] = x
+        self.y[i] = self.prev_y[i] = y
+        self.vx[i] = vx
+        self.vy[i] = vy
+        self.radius[i] = self.default_radius
+        self.alive[i] = True
+        self.count += 1
+
+    def clear(self):
+        self.alive[:self.count] = False
+        self.count = 0
+
+    def move(self):
+        n = self.count
+        self.x[:n] += self.vx[:n]
+        self.y[:n] += self.vy[:n]
+
+    def bounce(self, game_field):
+        n = self.count
+        x, y = self.x[:n], self.y[:n]
+        hit_x = (x < game_field.x_min) | (x > game_field.x_max)
+        hit_y = (y < game_field.y_min) | (y > game_field.y_max)
+        np.clip(x, game_field.x_min, game_field.x_max, out=x)
+        np.clip(y, game_field.y_min, game_field.y_max, out=y)
+        self.vx[:n][hit_x] *= -1
+        self.vy[:n][hit_y] *= -1
+
+    def outside(self, game_field):
+        n = self.count
+        x, y = self.x[:n], self.y[:n]
+        return (x < game_field.x_min) | (x > game_field.x_max) | (y < game_field.y_min) | (y > game_field.y_max)
+
+    def collides_with_point(self, x, y, radius):
+        n = self.count
+        dx = self.x[:n] - x
+        dy = self.y[:n] - y
+        return np.sqrt(dx * dx + dy * dy) < self.radius[:n] + radius
+
+    def collides_with_pool(self, other, rows):
+        n = other.count
+        dx = self.x[rows, None] - other.x[None, :n]
+        dy = self.y[rows, None] - other.y[None, :n]
+        return np.sqrt(dx * dx + dy * dy) < self.radius[rows, None] + other.radius[None, :n]
+
+    def compact(self):
+        n = self.count
+        keep = np.flatnonzero(self.alive[:n])
+        k = len(keep)
+        if k == n:
+            return
+        for arr in (self.x, self.y, self.prev_x, self.prev_y, self.vx, self.vy, self.radius):
+            arr[:k] = arr[keep]
+        self.alive[:k] = True
+        self.alive[k:n] = False
+        self.count = k
+
+    def save_positions(self):
+        n = self.count
+        self.prev_x[:n] = self.x[:n]
+        self.prev_y[:n] = self.y[:n]
+
+    def positions(self, alpha=1.0):
+        n = self.count
+        x = self.prev_x[:n] + (self.x[:n] - self.prev_x[:n]) * alpha
+        y = self.prev_y[:n] + (self.y[:n] - self.prev_y[:n]) * alpha
+        return zip(x.tolist(), y.tolist(), self.radius[:n].tolist())
+
+
+class PooledGameEngine(GameEngine):
+    # bullets are tested against all NPCs in row blocks to bound the size of
+    # the pairwise distance matrix
+    COLLISION_BLOCK = 256
+
+    def __init__(self, graph_engine, game_field, player, *, fps=60, clock=None, rng=random, **kwargs):
+        super().__init__(graph_engine, game_field, player, fps=fps, clock=clock, rng=rng, **kwargs)
+        self.npcs = EntityPool(18)
+        self.bullets = EntityPool(5)
+
+    def spawn_npc_at(self, x, y):
+        if len(self.npcs) >= MAX_NPCS:
+            return
+        speed_x = self.rng.choice([-1, 1]) * self.rng.randint(2, 5)
+        speed_y = self.rng.choice([-1, 1]) * self.rng.randint(2, 5)
+        self.npcs.add(x, y, speed_x, speed_y)
+
+    def fire_bullet(self):
+        bullet = self.player.fire()
+        self.bullets.add(bullet.x, bullet.y, bullet.vx, bullet.vy)
+
+    def move_entities(self, keys):
+        self.player.move(
+            keys[pygame.K_a] or keys[pygame.K_LEFT],
+            keys[pygame.K_d] or keys[pygame.K_RIGHT],
+            keys[pygame.K_w] or keys[pygame.K_UP],
+            keys[pygame.K_s] or keys[pygame.K_DOWN],
+            self.game_field
+        )
+
+        self.player.rotate(keys[pygame.K_e], keys[pygame.K_q])
+
+        self.npcs.move()
+        self.npcs.bounce(self.game_field)
+        self.bullets.move()
+
+    def find_collisions(self):
+        npcs, bullets = self.npcs, self.bullets
+        bullets.alive[:bullets.count] = ~bullets.outside(self.game_field)
+
+        # each bullet takes the lowest-index NPC it touches that an earlier
+        # bullet has not already taken, same as the list-based engine
+        live_rows = np.flatnonzero(bullets.alive[:bullets.count])
+        for start in range(0, len(live_rows), self.COLLISION_BLOCK):
+            rows = live_rows[start:start + self.COLLISION_BLOCK]
+            hits = bullets.collides_with_pool(npcs, rows)
+            # only the few rows that touch anything need the ordered pass
+            hit_rows = np.flatnonzero(hits.any(axis=1))
+            for row, hit in zip(rows[hit_rows].tolist(), hits[hit_rows]):
+                candidates = np.flatnonzero(hit & npcs.alive[:npcs.count])
+                if len(candidates):
+                    npcs.alive[candidates[0]] = False
+                    bullets.alive[row] = False
+                    self.score += 5
+
+        player = self.player
+        player_hits = np.flatnonzero(npcs.collides_with_point(player.x, player.y, player.radius)
+                                     & npcs.alive[:npcs.count])
+        coin_hits = [coin for coin in self.coins if player.collides_with(coin)]
+        return coin_hits, player_hits
+
+    def remove_collided(self, hits, current_time):
+        coin_hits, player_hits = hits
+        for coin in coin_hits:
+            self.score += 10
+            self.coins.remove(coin)
+
+        for npc_idx in player_hits:
+            if self.player.take_hit(current_time):
+                self.game_over = True
+                break
+            self.npcs.alive[npc_idx] = False
+
+        self.bullets.compact()
+        self.npcs.compact()
+
+    def save_positions(self):
+        self.player.prev_x = self.player.x
+        self.player.prev_y = self.player.y
+        self.npcs.save_positions()
+        self.bullets.save_positions()
+
+    def render_entities(self, alpha=1.0):
+        for coin in self.coins:
+            self.graph_engine.render_coin(coin.x, coin.y, coin.radius)
+
+        for x, y, radius in self.npcs.positions(alpha):
+            self.graph_engine.render_npc(x, y, radius)
+
+        for x, y, radius in self.bullets.positions(alpha):
+            self.graph_engine.render_bullet(x, y, radius)
+
+
+def paint_player(surface, center, radius, angle):
+    x, y = center
+    pygame.draw.circle(surface, (80, 180, 255), center, radius)
+    pygame.draw.circle(surface, (255, 255, 255), center, radius, 2)
+    # trig noise like sin(pi) = 1e-16 is rounded away so axis-aligned barrels
+    # land on the same pixels as when drawn at full screen coordinates
+    angle_rad = math.radians(angle)
+    cos_a = round(math.cos(angle_rad), 9)
+    sin_a = round(math.sin(angle_rad), 9)
+    end_x = x + radius * 1.5 * cos_a
+    end_y = y - radius * 1.5 * sin_a
+    pygame.draw.line(surface, (255, 255, 0), center, (int(end_x), int(end_y)), 4)
+    tip_x = x + (radius + 8) * cos_a
+    tip_y = y - (radius + 8) * sin_a
+    pygame.draw.circle(surface, (255, 255, 0), (int(tip_x), int(tip_y)), 5)
+
+
+def paint_npc(surface, center, radius, angle):
+    pygame.draw.circle(surface, (255, 80, 80), center, radius)
+    pygame.draw.circle(surface, (255, 200, 200), center, radius, 2)
+
+
+def paint_bullet(surface, center, radius, angle):
+    pygame.draw.circle(surface, (255, 255, 100), center, radius)
+
+
+def paint_coin(surface, center, radius, angle):
+    pygame.draw.circle(surface, (255, 215, 0), center, radius)
+    pygame.draw.circle(surface, (255, 255, 200), center, radius, 2)
+
+
+SPRITE_PAINTERS = {
+    "player": (paint_player, lambda radius: max(int(radius * 1.5) + 3, radius + 15)),
+    "npc": (paint_npc, lambda radius: radius + 1),
+    "bullet": (paint_bullet, lambda radius: radius + 1),
+    "coin": (paint_coin, lambda radius: radius + 1),
+}
+
+
+class SpriteCache:
+    def __init__(self):
+        self.sprites = {}
+
+    def get(self, kind, radius, angle=0):
+        key = (kind, radius, angle)
+        sprite = self.sprites.get(key)
+        if sprite is None:
+            paint, extent_of = SPRITE_PAINTERS[kind]
+            extent = extent_of(radius)
+            surface = pygame.Surface((extent * 2 + 1, extent * 2 + 1), pygame.SRCALPHA)
+            paint(surface, (extent, extent), radius, angle)
+            sprite = self.sprites[key] = (surface.convert_alpha(), extent)
+        return sprite
+
+
+class TextCache:
+    def __init__(self, max_size=TEXT_CACHE_SIZE):
+        self.max_size = max_size
+        self.surfaces = OrderedDict()
+
+    def render(self, font, text, color):
+        key = (text, color, font)
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = self.surfaces[key] = font.render(text, True, color)
+            if len(self.surfaces) > self.max_size:
+                self.surfaces.popitem(last=False)
+        else:
+            self.surfaces.move_to_end(key)
+        return surface
+
 
 class PygameGraphicsEngine:
     def __init__(self, width, height):
@@ -295,62 +715,127 @@ class PygameGraphicsEngine:
         self.height = height
         self.screen = pygame.display.set_mode((width, height))
         pygame.display.set_caption("Shooter Game")
+        pygame.font.init()
+        self.font = pygame.font.SysFont('Arial', 32)
+        self.sprites = SpriteCache()
+        self.pending_sprites = []
+        self.texts = TextCache()
+        self.overlay = None
+        self.dirty = DirtyRectRenderer(self.screen, (30, 30, 50))
 
     def start_frame(self):
-        self.screen.fill((30, 30, 50))
+        self.dirty.start_frame()
 
     def show_frame(self):
-        pygame.display.flip()
+        self.flush_sprites()
+        self.dirty.show_frame()
+
+    def invalidate(self):
+        self.dirty.invalidate()
+
+    def queue_sprite(self, sprite, x, y):
+        surface, extent = sprite
+        self.pending_sprites.append((surface, (int(x) - extent, int(y) - extent)))
+
+    def flush_sprites(self):
+        # every entity drawn since the last flush goes out in one blits call
+        if self.pending_sprites:
+            self.dirty.blits(self.pending_sprites)
+            self.pending_sprites.clear()
 
     def render_player(self, x, y, radius, angle):
-        pygame.draw.circle(self.screen, (80, 180, 255), (int(x), int(y)), radius)
-        pygame.draw.circle(self.screen, (255, 255, 255), (int(x), int(y)), radius, 2)
-        angle_rad = math.radians(angle)
-        end_x = x + radius * 1.5 * math.cos(angle_rad)
-        end_y = y - radius * 1.5 * math.sin(angle_rad)
-        pygame.draw.line(self.screen, (255, 255, 0), (int(x), int(y)), (int(end_x), int(end_y)), 4)
-        tip_x = x + (radius + 8) * math.cos(angle_rad)
-        tip_y = y - (radius + 8) * math.sin(angle_rad)
-        pygame.draw.circle(self.screen, (255, 255, 0), (int(tip_x), int(tip_y)), 5)
+        bucket = round(angle / ANGLE_BUCKET) * ANGLE_BUCKET % 360
+        self.queue_sprite(self.sprites.get("player", radius, bucket), x, y)
 
     def render_npc(self, x, y, radius):
-        pygame.draw.circle(self.screen, (255, 80, 80), (int(x), int(y)), radius)
-        pygame.draw.circle(self.screen, (255, 200, 200), (int(x), int(y)), radius, 2)
+        self.queue_sprite(self.sprites.get("npc", radius), x, y)
 
     def render_bullet(self, x, y, radius):
-        pygame.draw.circle(self.screen, (255, 255, 100), (int(x), int(y)), radius)
+        self.queue_sprite(self.sprites.get("bullet", radius), x, y)
 
     def render_coin(self, x, y, radius):
-        pygame.draw.circle(self.screen, (255, 215, 0), (int(x), int(y)), radius)
-        pygame.draw.circle(self.screen, (255, 255, 200), (int(x), int(y)), radius, 2)
+        self.queue_sprite(self.sprites.get("coin", radius), x, y)
+
+    def render_text(self, text, color):
+        return self.texts.render(self.font, text, color)
 
     def render_hud(self, score, lives):
-        score_text = font.render(f'Score: {score}', True, (255, 255, 255))
-        self.screen.blit(score_text, (20, 20))
-        lives_text = font.render(f'Lives: {lives}', True, (255, 100, 100))
-        self.screen.blit(lives_text, (20, 55))
-        controls_text = font.render('WASD:move  Q/E:rotate  SPACE:fire  Click:spawn NPC', True, (150, 150, 150))
-        self.screen.blit(controls_text, (20, self.height - 40))
+        self.flush_sprites()
+        score_text = self.render_text(f'Score: {score}', (255, 255, 255))
+        self.dirty.blit(score_text, (20, 20))
+        lives_text = self.render_text(f'Lives: {lives}', (255, 100, 100))
+        self.dirty.blit(lives_text, (20, 55))
+        controls_text = self.render_text('WASD:move  Q/E:rotate  SPACE:fire  Click:spawn NPC', (150, 150, 150))
+        self.dirty.blit(controls_text, (20, self.height - 40))
 
     def render_game_over(self, score):
-        overlay = pygame.Surface((self.width, self.height), pygame.SRCALPHA)
-        overlay.fill((0, 0, 0, 180))
-        self.screen.blit(overlay, (0, 0))
-        game_over_text = font.render('GAME OVER', True, (255, 80, 80))
+        self.flush_sprites()
+        if self.overlay is None:
+            self.overlay = pygame.Surface((self.width, self.height), pygame.SRCALPHA)
+            self.overlay.fill((0, 0, 0, 180))
+        self.dirty.blit(self.overlay, (0, 0))
+        game_over_text = self.render_text('GAME OVER', (255, 80, 80))
         text_rect = game_over_text.get_rect(center=(self.width / 2, self.height / 2 - 30))
-        self.screen.blit(game_over_text, text_rect)
-        score_text = font.render(f'Final Score: {score}', True, (255, 255, 255))
+        self.dirty.blit(game_over_text, text_rect)
+        score_text = self.render_text(f'Final Score: {score}', (255, 255, 255))
         score_rect = score_text.get_rect(center=(self.width / 2, self.height / 2 + 10))
-        self.screen.blit(score_text, score_rect)
-        restart_text = font.render('Press R to restart', True, (200, 200, 200))
+        self.dirty.blit(score_text, score_rect)
+        restart_text = self.render_text('Press R to restart', (200, 200, 200))
         restart_rect = restart_text.get_rect(center=(self.width / 2, self.height / 2 + 50))
-        self.screen.blit(restart_text, restart_rect)
+        self.dirty.blit(restart_text, restart_rect)
+
+
+class NullGraphicsEngine:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+
+    def start_frame(self):
+        pass
+
+    def show_frame(self):
+        pass
+
+    def invalidate(self):
+        pass
+
+    def render_player(self, x, y, radius, angle):
+        pass
+
+    def render_npc(self, x, y, radius):
+        pass
+
+    def render_bullet(self, x, y, radius):
+        pass
+
+    def render_coin(self, x, y, radius):
+        pass
+
+    def render_hud(self, score, lives):
+        pass
+
+    def render_game_over(self, score):
+        pass
+
+
+def make_headless_engine(seed=0, *, width=1280, height=720, fps=60, engine_class=GameEngine):
+    rng = random.Random(seed)
+    game_field = GameField(0, 0, width, height, rng=rng)
+    player = Player(width / 2, height / 2, speed=10)
+    return engine_class(NullGraphicsEngine(width, height), game_field, player, fps=fps,
+                        clock=SimulatedClock(), rng=rng)
 
 
 if __name__ == "__main__":
-    pygame.init()
-    game_field = GameField(0, 0, 1280, 720)
-    player = Player(640, 360, speed=10)
-    graph_engine = PygameGraphicsEngine(1280, 720)
-    game_engine = GameEngine(graph_engine, game_field, player, fps=60)
-    game_engine.run_game()
+    if "--headless" in sys.argv[1:]:
+        ticks = 10000
+        game_engine = make_headless_engine(seed=0)
+        tps = game_engine.run_headless(ticks)
+        print(f"{ticks} ticks, {tps:.0f} ticks/s, score {game_engine.score}, npcs {len(game_engine.npcs)}")
+    else:
+        pygame.init()
+        game_field = GameField(0, 0, 1280, 720)
+        player = Player(640, 360, speed=10)
+        graph_engine = PygameGraphicsEngine(1280, 720)
+        game_engine = GameEngine(graph_engine, game_field, player, fps=60)
+        game_engine.run_game()
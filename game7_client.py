@@ -1,6 +1,40 @@
+from collections import deque
+import select
 import socket
+import sys
+import time
+from threading import Thread
 import pygame
 
+from dirty_rects import DirtyRectRenderer
+from game7_netsim import LossyLink, link_options
+from game7_protocol import (MAX_DATAGRAM_SIZE, MSG_LEAVE, MSG_STATE, MSG_WELCOME, FrameReader, ProtocolError,
+                            apply_delta, decode_state, decode_welcome, delta_state, encode_command, encode_inputs,
+                            encode_join, encode_leave, message_type, send_frame)
+from game7_server import TICK_INTERVAL, Player
+
+DELTA_BASELINES = 64
+# unacknowledged commands kept for replay; older ones are dropped
+MAX_PENDING_INPUTS = 256
+# corrections smaller than this (e.g. delta quantization) are not counted
+CORRECTION_EPSILON = 0.5
+# remote entities are drawn this many seconds in the past so there is
+# usually a snapshot on either side to interpolate between
+INTERP_DELAY = 0.1
+# how far past the newest snapshot positions are extrapolated on a gap
+MAX_EXTRAPOLATION = 0.25
+SNAPSHOT_BUFFER_SIZE = 32
+# how far a snapshot that arrived later than the best one seen so far pulls
+# the server clock offset up; earlier ones pull it down at once
+CLOCK_SMOOTHING = 0.02
+# UDP: each input datagram repeats this many of the latest commands
+REDUNDANT_INPUTS = 4
+JOIN_RETRY = 0.2
+JOIN_TIMEOUT = 5.0
+LEAVE_RETRY = 0.1
+LEAVE_TIMEOUT = 1.0
+UDP_TIMEOUT = 5.0
+
 HOST = '127.0.0.1'
 PORT = 21001
 WIDTH = 800
@@ -12,14 +46,15 @@ font = pygame.font.SysFont('Arial', 24)
 screen = pygame.display.set_mode((WIDTH, HEIGHT))
 pygame.display.set_caption("Multiplayer NPC Eater")
 clock = pygame.time.Clock()
+dirty = DirtyRectRenderer(screen, (30, 30, 50))
 
 
 def render_state(state, my_id):
-    screen.fill((30, 30, 50))
+    dirty.start_frame()
 
     for npc in state.get("npcs", []):
         pygame.draw.circle(screen, (255, 80, 80), (int(npc["x"]), int(npc["y"])), npc["r"])
-        pygame.draw.circle(screen, (255, 200, 200), (int(npc["x"]), int(npc["y"])), npc["r"], 2)
+        dirty.add(pygame.draw.circle(screen, (255, 200, 200), (int(npc["x"]), int(npc["y"])), npc["r"], 2))
 
     for p in state.get("players", []):
         if p["id"] == my_id:
@@ -27,38 +62,345 @@ def render_state(state, my_id):
         else:
             color = (80, 255, 80)
         pygame.draw.circle(screen, color, (int(p["x"]), int(p["y"])), 20)
-        pygame.draw.circle(screen, (255, 255, 255), (int(p["x"]), int(p["y"])), 20, 2)
+        dirty.add(pygame.draw.circle(screen, (255, 255, 255), (int(p["x"]), int(p["y"])), 20, 2))
 
     y_offset = 10
     sorted_players = sorted(state.get("players", []), key=lambda x: x["score"], reverse=True)
     for p in sorted_players:
         prefix = ">> " if p["id"] == my_id else ""
         text = font.render(f'{prefix}Player {p["id"]}: {p["score"]}', True, (255, 255, 255))
-        screen.blit(text, (WIDTH - 200, y_offset))
+        dirty.blit(text, (WIDTH - 200, y_offset))
         y_offset += 30
 
     controls = font.render("WASD to move, Q to quit", True, (150, 150, 150))
-    screen.blit(controls, (10, HEIGHT - 30))
+    dirty.blit(controls, (10, HEIGHT - 30))
+
+    dirty.show_frame()
+
+
+class Prediction:
+    def __init__(self):
+        self.player = None
+        self.seq = 0
+        self.pending = deque(maxlen=MAX_PENDING_INPUTS)
+        self.corrections = 0
+
+    def next_input(self, actions):
+        # applied locally right away, then replayed on top of every
+        # authoritative position until the server acknowledges it
+        self.seq += 1
+        self.pending.append((self.seq, actions))
+        if self.player is not None:
+            self.player.apply(actions)
+        return self.seq
+
+    def reconcile(self, state, my_id):
+        me = next((p for p in state.get("players", []) if p["id"] == my_id), None)
+        if me is None:
+            return
+        while self.pending and self.pending[0][0] <= me["input_seq"]:
+            self.pending.popleft()
+        if self.player is None:
+            self.player = Player(my_id, me["x"], me["y"])
+            predicted = None
+        else:
+            predicted = (self.player.x, self.player.y)
+            self.player.x, self.player.y = me["x"], me["y"]
+        for _, actions in self.pending:
+            self.player.apply(actions)
+        if predicted and abs(self.player.x - predicted[0]) + abs(self.player.y - predicted[1]) > CORRECTION_EPSILON:
+            self.corrections += 1
+
+    def place(self, state, my_id):
+        # the local player is drawn where prediction puts it, not at its
+        # delayed snapshot position
+        if self.player is None:
+            return
+        for p in state["players"]:
+            if p["id"] == my_id:
+                p["x"], p["y"] = self.player.x, self.player.y
+
+
+def blend_entities(older, newer, t):
+    old_by_id = {e["id"]: e for e in older}
+    new_by_id = {e["id"]: e for e in newer}
+    # membership follows whichever snapshot render time has reached, so
+    # spawns and removals show up on time
+    blended = []
+    for e in (older if t < 1 else newer):
+        a = old_by_id.get(e["id"])
+        b = new_by_id.get(e["id"])
+        e = dict(e)
+        if a is not None and b is not None:
+            e["x"] = a["x"] + (b["x"] - a["x"]) * t
+            e["y"] = a["y"] + (b["y"] - a["y"]) * t
+        blended.append(e)
+    return blended
+
+
+class SnapshotBuffer:
+    # snapshots sit on the server's timeline (tick * TICK_INTERVAL), not at
+    # the time they happened to arrive, so network jitter doesn't show up as
+    # uneven motion. offset maps local time onto that timeline: each arrival
+    # is its server time plus that packet's delay, and the least delayed
+    # packet gives the best estimate
+    def __init__(self, delay=INTERP_DELAY, max_extrapolation=MAX_EXTRAPOLATION, size=SNAPSHOT_BUFFER_SIZE):
+        self.delay = delay
+        self.max_extrapolation = max_extrapolation
+        self.snapshots = deque(maxlen=size)
+        self.offset = None
+
+    def push(self, state, now):
+        # a new self id means the server moved us to another room, whose
+        # ticks and entities have nothing to do with the old one's
+        if self.snapshots and state["self"] != self.snapshots[-1][1]["self"]:
+            self.snapshots.clear()
+            self.offset = None
+        # request/response clients can see the same server tick twice
+        if self.snapshots and state["tick"] <= self.snapshots[-1][1]["tick"]:
+            return
+        server_time = state["tick"] * TICK_INTERVAL
+        offset = now - server_time
+        if self.offset is None or offset < self.offset:
+            self.offset = offset
+        else:
+            self.offset += (offset - self.offset) * CLOCK_SMOOTHING
+        self.snapshots.append((server_time, state))
+
+    def sample(self, now):
+        if not self.snapshots:
+            return None
+        render_time = now - self.offset - self.delay
+        older, newer = self.snapshots[max(0, len(self.snapshots) - 2)], self.snapshots[-1]
+        for i in range(1, len(self.snapshots)):
+            if self.snapshots[i][0] >= render_time:
+                older, newer = self.snapshots[i - 1], self.snapshots[i]
+                break
+        span = newer[0] - older[0]
+        if span > 0:
+            # never extrapolate more than max_extrapolation past the newest
+            elapsed = min(render_time, newer[0] + self.max_extrapolation) - older[0]
+            t = max(0.0, elapsed / span)
+        else:
+            t = 1.0
+        state = dict(older[1] if t < 1 else newer[1])
+        state["players"] = blend_entities(older[1]["players"], newer[1]["players"], t)
+        state["npcs"] = blend_entities(older[1]["npcs"], newer[1]["npcs"], t)
+        return state
+
+
+class NetworkWorker:
+    # owns the socket on a background thread. The render loop queues inputs
+    # and reads self.latest, a (received_at, my_id, state) tuple that is only
+    # ever replaced whole, so neither side takes a lock. Every snapshot is
+    # also appended to self.received for the interpolation buffer
+    def __init__(self, sock, push=False, delta=False):
+        self.sock = sock
+        self.push = push
+        self.delta = delta
+        self.inputs = deque()
+        self.latest = None
+        self.received = deque(maxlen=SNAPSHOT_BUFFER_SIZE)
+        self.closed = False
+        self.running = True
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.wake_r.setblocking(False)
+        self.wake_w.setblocking(False)
+        self.thread = Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def wake(self):
+        try:
+            self.wake_w.send(b"\0")
+        except BlockingIOError:
+            pass  # a wakeup is already pending
+
+    def stop(self):
+        self.running = False
+        self.wake()
+        try:
+            # unblocks a read_frame waiting on a half-received frame
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.thread.join()
+        self.wake_r.close()
+        self.wake_w.close()
 
-    pygame.display.flip()
+    def send_input(self, actions, seq):
+        self.inputs.append((actions, seq))
+        self.wake()
 
+    def run(self):
+        try:
+            self.serve()
+        except (OSError, ProtocolError) as e:
+            if self.running:
+                print(f"Connection error: {e}")
+        self.closed = True
+
+    def serve(self):
+        reader = FrameReader(self.sock)
+        my_id = None
+        baselines = {}
+        ack = 0
+        if self.push:
+            data = reader.read_frame()
+            if data is None:
+                return
+            my_id = decode_welcome(data)
+
+        while self.running:
+            while self.inputs:
+                actions, seq = self.inputs.popleft()
+                send_frame(self.sock, encode_command(actions, seq, ack))
+
+            if not reader.frame_ready():
+                readable = select.select([self.sock, self.wake_r], [], [])[0]
+                if self.wake_r in readable:
+                    self.wake_r.recv(4096)
+                if self.sock not in readable:
+                    continue
+
+            data = reader.read_frame()
+            if data is None:
+                return
+            received_at = time.perf_counter()
+            if self.delta:
+                try:
+                    my_id, ack, entities = apply_delta(data, baselines)
+                except ProtocolError as e:
+                    # lost our baseline: ack 0 so the server sends a keyframe
+                    print(f"Resyncing: {e}")
+                    ack = 0
+                    continue
+                baselines[ack] = entities
+                for seq in [seq for seq in baselines if seq < ack - DELTA_BASELINES]:
+                    del baselines[seq]
+                state = delta_state(my_id, ack, entities)
+            else:
+                state = decode_state(data)
+                if not self.push:
+                    my_id = state["self"]
+            self.latest = (received_at, my_id, state)
+            self.received.append(self.latest)
+
+
+class UdpNetworkWorker(NetworkWorker):
+    # same handoff as NetworkWorker over UDP: snapshots are unreliable and
+    # stale ones dropped, inputs are sent redundantly, join/leave are resent
+    # until answered
+    def __init__(self, sock, link):
+        super().__init__(sock)
+        self.link = link
+        self.history = deque(maxlen=REDUNDANT_INPUTS)
+        self.stale = 0
+
+    def stop(self):
+        self.running = False
+        self.wake()
+        self.thread.join()
+        self.leave()
+        self.link.close()
+        self.wake_r.close()
+        self.wake_w.close()
+
+    def request(self, message, reply_type, retry, timeout):
+        deadline = time.perf_counter() + timeout
+        next_send = 0
+        while time.perf_counter() < deadline:
+            now = time.perf_counter()
+            if now >= next_send:
+                self.link.sendto(message)
+                next_send = now + retry
+            if select.select([self.sock], [], [], next_send - now)[0]:
+                data = self.sock.recv(MAX_DATAGRAM_SIZE)
+                if message_type(data) == reply_type:
+                    return data
+        return None
+
+    def leave(self):
+        try:
+            self.request(encode_leave(), MSG_LEAVE, LEAVE_RETRY, LEAVE_TIMEOUT)
+        except OSError:
+            pass
+
+    def serve(self):
+        data = self.request(encode_join(), MSG_WELCOME, JOIN_RETRY, JOIN_TIMEOUT)
+        if data is None:
+            print("No reply from server. Make sure game7_server.py is running with --udp.")
+            return
+        my_id = decode_welcome(data)
+        last_tick = 0
+        last_heard = time.perf_counter()
+
+        while self.running:
+            if self.inputs:
+                while self.inputs:
+                    actions, seq = self.inputs.popleft()
+                    self.history.append((seq, actions))
+                self.link.sendto(encode_inputs(self.history))
 
-def main():
+            readable = select.select([self.sock, self.wake_r], [], [], UDP_TIMEOUT)[0]
+            if self.wake_r in readable:
+                self.wake_r.recv(4096)
+            if self.sock not in readable:
+                if time.perf_counter() - last_heard > UDP_TIMEOUT:
+                    print("Server stopped sending snapshots")
+                    return
+                continue
+
+            data = self.sock.recv(MAX_DATAGRAM_SIZE)
+            received_at = last_heard = time.perf_counter()
+            if message_type(data) != MSG_STATE:
+                continue  # a late duplicate welcome
+            state = decode_state(data)
+            # datagrams can be lost, duplicated or reordered; only newer
+            # ticks are worth showing
+            if state["tick"] <= last_tick:
+                self.stale += 1
+                continue
+            last_tick = state["tick"]
+            self.latest = (received_at, my_id, state)
+            self.received.append(self.latest)
+
+
+def connect(push, delta, udp, options):
+    if udp:
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.connect((HOST, PORT))
+        return UdpNetworkWorker(s, LossyLink(s, **options))
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
         s.connect((HOST, PORT))
     except ConnectionRefusedError:
         print("Could not connect to server. Make sure game7_server.py is running.")
-        return
-
+        return None
+    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
     print("Connected to server")
+    return NetworkWorker(s, push, delta)
+
+
+def main(push=False, delta=False, interp_delay=INTERP_DELAY, udp=False, options=None):
+    worker = connect(push, delta, udp, options or {})
+    if worker is None:
+        return
+    s = worker.sock
+    worker.start()
     my_id = None
+    seen = None
+    prediction = Prediction()
+    snapshots = SnapshotBuffer(interp_delay)
     running = True
 
-    while running:
+    while running and not worker.closed:
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
+            elif event.type in (pygame.WINDOWEXPOSED, pygame.VIDEOEXPOSE):
+                dirty.invalidate()
 
         keys = pygame.key.get_pressed()
         if keys[pygame.K_q]:
@@ -74,24 +416,36 @@ def main():
             actions["up"] = 1
         if keys[pygame.K_s] or keys[pygame.K_DOWN]:
             actions["down"] = 1
+        worker.send_input(actions, prediction.next_input(actions))
 
-        try:
-            s.sendall(str(actions).encode())
-            data = s.recv(4096)
-            if not data:
-                break
-            state = eval(data.decode())
-            my_id = state.get("self", my_id)
-            render_state(state, my_id)
-        except Exception as e:
-            print(f"Connection error: {e}")
-            break
+        while worker.received:
+            received_at, _, state = worker.received.popleft()
+            snapshots.push(state, received_at)
+        latest = worker.latest
+        if latest is not seen:
+            seen = latest
+            _, my_id, state = latest
+            prediction.reconcile(state, my_id)
+
+        view = snapshots.sample(time.perf_counter())
+        if view is not None:
+            prediction.place(view, my_id)
+            render_state(view, my_id)
 
         clock.tick(60)
 
+    worker.stop()
+    print(f"Prediction corrections: {prediction.corrections}")
     s.close()
     pygame.quit()
 
 
 if __name__ == "__main__":
-    main()
+    interp_delay = INTERP_DELAY
+    for arg in sys.argv[1:]:
+        if arg.startswith("--interp-delay="):
+            interp_delay = float(arg.split("=", 1)[1])
+        elif arg.startswith("--port="):
+            PORT = int(arg.split("=", 1)[1])
+    main(push="--push" in sys.argv[1:], delta="--delta" in sys.argv[1:], interp_delay=interp_delay,
+         udp="--udp" in sys.argv[1:], options=link_options(sys.argv[1:]))
@@ -0,0 +1,221 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+from game7_protocol import (FRAME_HEADER, ProtocolError, apply_delta, decode_welcome, encode_actions, encode_frame,
+                            encode_input, read_frame_async)
+
+HOST = '127.0.0.1'
+PORT = 21001
+DIRECTIONS = ("left", "right", "up", "down")
+
+
+def idle_script(bot_id, tick, rng):
+    return {}
+
+
+def circle_script(bot_id, tick, rng):
+    return {DIRECTIONS[(tick // 30 + bot_id) % len(DIRECTIONS)]: 1}
+
+
+def random_script(bot_id, tick, rng):
+    # hold a random direction set for ~half a second at a time
+    if tick % 30 == 0:
+        random_script.held[bot_id] = {d: 1 for d in DIRECTIONS if rng.random() < 0.3}
+    return random_script.held.get(bot_id, {})
+
+
+random_script.held = {}
+
+SCRIPTS = {"idle": idle_script, "circle": circle_script, "random": random_script}
+
+
+class BotStats:
+    def __init__(self, bot_id):
+        self.bot_id = bot_id
+        self.rtts = []
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.replies = 0
+        self.error = None
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+async def run_bot(stats, host, port, mode, script, rate, deadline, rng):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    loop = asyncio.get_running_loop()
+    baselines = {}
+    ack = 0
+    receiver = None
+    try:
+        if mode == "push":
+            data = await read_frame_async(reader)
+            decode_welcome(data)
+            stats.bytes_received += FRAME_HEADER.size + len(data)
+
+            async def receive():
+                while True:
+                    data = await read_frame_async(reader)
+                    stats.bytes_received += FRAME_HEADER.size + len(data)
+                    stats.replies += 1
+
+            receiver = asyncio.ensure_future(receive())
+
+        next_send = loop.time()
+        tick = 0
+        while loop.time() < deadline:
+            actions = script(stats.bot_id, tick, rng)
+            payload = encode_input(actions, ack) if mode == "delta" else encode_actions(actions)
+            frame = encode_frame(payload)
+            sent_at = time.perf_counter()
+            writer.write(frame)
+            stats.bytes_sent += len(frame)
+            await writer.drain()
+
+            if mode != "push":
+                data = await read_frame_async(reader)
+                stats.rtts.append(time.perf_counter() - sent_at)
+                stats.bytes_received += FRAME_HEADER.size + len(data)
+                stats.replies += 1
+                if mode == "delta":
+                    try:
+                        _, ack, entities = apply_delta(data, baselines)
+                        baselines = {ack: entities}
+                    except ProtocolError:
+                        ack = 0
+
+            tick += 1
+            next_send += 1 / rate
+            await asyncio.sleep(max(0.0, next_send - loop.time()))
+    finally:
+        if receiver is not None:
+            receiver.cancel()
+        writer.close()
+
+
+async def run_load(args):
+    rng = random.Random(args.seed)
+    script = SCRIPTS[args.script]
+    all_stats = [BotStats(i + 1) for i in range(args.clients)]
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    deadline = start + args.ramp + args.duration
+
+    async def bot(stats, delay):
+        await asyncio.sleep(delay)
+        try:
+            await run_bot(stats, args.host, args.port, args.mode, script, args.rate, deadline,
+                          random.Random(rng.random()))
+        except (OSError, asyncio.IncompleteReadError, ProtocolError) as e:
+            stats.error = repr(e)
+
+    # connections are spread over the ramp so the listen backlog is not flooded
+    await asyncio.gather(*(bot(stats, args.ramp * i / args.clients) for i, stats in enumerate(all_stats)))
+    return all_stats, loop.time() - start
+
+
+def wait_for_port(host, port, timeout=10.0):
+    end = time.time() + timeout
+    while time.time() < end:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def to_ms(seconds):
+    return None if seconds is None else seconds * 1e3
+
+
+def report(all_stats, elapsed, args):
+    rtts = [rtt for stats in all_stats for rtt in stats.rtts]
+    replies = sum(stats.replies for stats in all_stats)
+    failed = [stats for stats in all_stats if stats.error]
+    summary = {
+        "clients": args.clients,
+        "failed_clients": len(failed),
+        "mode": args.mode,
+        "script": args.script,
+        "rate_hz": args.rate,
+        "duration_s": elapsed,
+        "replies": replies,
+        "replies_per_sec": replies / elapsed,
+        "bytes_sent": sum(stats.bytes_sent for stats in all_stats),
+        "bytes_received": sum(stats.bytes_received for stats in all_stats),
+        "rtt_ms": {f"p{pct}": to_ms(percentile(rtts, pct)) for pct in (50, 90, 95, 99)},
+        "per_client": [{"id": stats.bot_id,
+                        "replies": stats.replies,
+                        "bytes_sent": stats.bytes_sent,
+                        "bytes_received": stats.bytes_received,
+                        "rtt_ms": {f"p{pct}": to_ms(percentile(stats.rtts, pct)) for pct in (50, 95, 99)},
+                        "error": stats.error}
+                       for stats in all_stats],
+    }
+
+    print(f"{args.clients} clients ({len(failed)} failed), mode {args.mode}, {elapsed:.1f}s")
+    print(f"replies/s: {summary['replies_per_sec']:.0f}")
+    print(f"bytes sent: {summary['bytes_sent']}  received: {summary['bytes_received']}")
+    if rtts:
+        print("rtt ms: " + "  ".join(f"{name} {value:.2f}" for name, value in summary["rtt_ms"].items()))
+    for stats in failed[:5]:
+        print(f"  bot {stats.bot_id}: {stats.error}")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless bot load generator for game7_server")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=60.0, help="actions sent per second per bot")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--ramp", type=float, default=2.0, help="seconds over which connections are opened")
+    parser.add_argument("--mode", choices=("rr", "delta", "push"), default="rr",
+                        help="must match the server: request/response, --delta or --push")
+    parser.add_argument("--script", choices=tuple(SCRIPTS), default="random")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--spawn-server", metavar="FLAGS", nargs="?", const="",
+                        help="start a local game7_server.py with these flags for the run, "
+                             "e.g. --spawn-server=\"--asyncio --delta\"")
+    parser.add_argument("--out", help="write the JSON report here")
+    args = parser.parse_args()
+
+    server = None
+    if args.spawn_server is not None:
+        server_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "game7_server.py")
+        server = subprocess.Popen([sys.executable, server_path, *args.spawn_server.split()],
+                                  stdout=subprocess.DEVNULL)
+        if not wait_for_port(args.host, args.port):
+            server.terminate()
+            print("Server did not start listening in time")
+            return
+    try:
+        all_stats, elapsed = asyncio.run(run_load(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    summary = report(all_stats, elapsed, args)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
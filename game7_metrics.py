@@ -0,0 +1,215 @@
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import time
+from threading import Lock, Thread
+
+# samples kept per histogram; at 60 ticks/s this is the last 10 seconds
+HISTORY = 600
+# histogram bucket upper bounds in milliseconds
+BUCKETS_MS = (0.1, 0.5, 1, 2, 5, 10, 20, 50, 100)
+
+
+class RollingHistogram:
+    # appends and list() copies of a deque are atomic under the GIL, so
+    # any thread can add samples while another reports
+    def __init__(self, window=HISTORY):
+        self.samples = deque(maxlen=window)
+
+    def add(self, value):
+        self.samples.append(value)
+
+    def summary(self):
+        samples = sorted(self.samples)
+        if not samples:
+            return {"count": 0}
+        n = len(samples)
+        return {"count": n,
+                "mean": sum(samples) / n,
+                "p50": samples[n // 2],
+                "p95": samples[min(n - 1, n * 95 // 100)],
+                "p99": samples[min(n - 1, n * 99 // 100)],
+                "max": samples[-1]}
+
+    def buckets(self):
+        counts = [0] * (len(BUCKETS_MS) + 1)
+        for value in list(self.samples):
+            for i, bound in enumerate(BUCKETS_MS):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+        labels = [f"<={bound}" for bound in BUCKETS_MS] + [f">{BUCKETS_MS[-1]}"]
+        return dict(zip(labels, counts))
+
+
+class TimedLock:
+    def __init__(self, name):
+        self.name = name
+        self.lock = Lock()
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.waits = RollingHistogram()
+        self.holds = RollingHistogram()
+        self.acquired_at = 0.0
+
+    def __enter__(self):
+        if not self.lock.acquire(blocking=False):
+            start = time.perf_counter()
+            self.lock.acquire()
+            wait = time.perf_counter() - start
+            # counters are only touched while holding the lock
+            self.contended += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            self.waits.add(wait * 1e3)
+        else:
+            self.waits.add(0.0)
+        self.acquisitions += 1
+        self.acquired_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.holds.add((time.perf_counter() - self.acquired_at) * 1e3)
+        self.lock.release()
+
+    def stats(self):
+        avg = self.wait_total / self.contended * 1e3 if self.contended else 0.0
+        return (f"{self.name}: {self.acquisitions} acquisitions, {self.contended} contended, "
+                f"wait avg {avg:.3f} ms max {self.wait_max * 1e3:.3f} ms")
+
+    def as_dict(self):
+        return {"acquisitions": self.acquisitions, "contended": self.contended,
+                "wait_ms": self.waits.summary(), "hold_ms": self.holds.summary()}
+
+
+class ServerMetrics:
+    def __init__(self, target_interval, locks=()):
+        self.target_interval = target_interval
+        self.locks = locks
+        self.histograms = {name: RollingHistogram() for name in
+                           ("tick_interval_ms", "tick_drift_ms", "update_ms", "snapshot_publish_ms",
+                            "snapshot_encode_ms", "broadcast_ms", "clients")}
+        self.ticks = 0
+        self.overruns = 0
+        self.clients = 0
+        self.last_tick = None
+        # per-client counters; each pid is only written by the thread that
+        # serves it
+        self.bytes_sent = {}
+        self.frames_skipped = {}
+        self.report_time = time.perf_counter()
+        self.report_bytes = {}
+
+    def observe(self, name, seconds):
+        self.histograms[name].add(seconds * 1e3)
+
+    def tick(self, start, update_time, clients, lateness):
+        # drift is how late the tick started against its scheduled deadline
+        if self.last_tick is not None:
+            self.observe("tick_interval_ms", start - self.last_tick)
+        self.last_tick = start
+        self.observe("tick_drift_ms", lateness)
+        self.observe("update_ms", update_time)
+        if update_time > self.target_interval:
+            self.overruns += 1
+        self.ticks += 1
+        self.clients = clients
+        self.histograms["clients"].add(clients)
+
+    def add_bytes(self, pid, count):
+        self.bytes_sent[pid] = self.bytes_sent.get(pid, 0) + count
+
+    def skipped(self, pid):
+        # a push frame replaced before it was sent: the client is too slow
+        self.frames_skipped[pid] = self.frames_skipped.get(pid, 0) + 1
+
+    def remove_client(self, pid):
+        self.bytes_sent.pop(pid, None)
+        self.frames_skipped.pop(pid, None)
+        self.report_bytes.pop(pid, None)
+
+    def client_rates(self):
+        now = time.perf_counter()
+        elapsed = max(now - self.report_time, 1e-9)
+        totals = dict(self.bytes_sent)
+        rates = {pid: (total - self.report_bytes.get(pid, 0)) / elapsed for pid, total in totals.items()}
+        self.report_time = now
+        self.report_bytes = totals
+        return rates
+
+    def as_dict(self):
+        return {"ticks": self.ticks,
+                "overruns": self.overruns,
+                "clients": self.clients,
+                "target_interval_ms": self.target_interval * 1e3,
+                "histograms": {name: dict(hist.summary(), buckets=hist.buckets())
+                               for name, hist in self.histograms.items()},
+                "locks": {lock.name: lock.as_dict() for lock in self.locks},
+                "per_client": {pid: {"bytes_sent": total, "frames_skipped": self.frames_skipped.get(pid, 0)}
+                               for pid, total in list(self.bytes_sent.items())}}
+
+    def log_lines(self):
+        def ms(name, field):
+            return self.histograms[name].summary().get(field, 0.0)
+
+        lines = [f"Tick: {self.ticks} ticks, interval p50 {ms('tick_interval_ms', 'p50'):.2f} ms, "
+                 f"drift p99 {ms('tick_drift_ms', 'p99'):.2f} ms, update p50 {ms('update_ms', 'p50'):.3f} "
+                 f"p99 {ms('update_ms', 'p99'):.3f} ms, publish p99 {ms('snapshot_publish_ms', 'p99'):.3f} ms, "
+                 f"encode p99 {ms('snapshot_encode_ms', 'p99'):.3f} ms, "
+                 f"broadcast p99 {ms('broadcast_ms', 'p99'):.3f} ms, {self.overruns} overruns"]
+        rates = self.client_rates()
+        if rates:
+            skipped = sum(self.frames_skipped.values())
+            lines.append(f"Clients: {self.clients}, sent {min(rates.values()) / 1024:.1f}-"
+                         f"{max(rates.values()) / 1024:.1f} KiB/s per client, {skipped} frames skipped")
+        else:
+            lines.append(f"Clients: {self.clients}")
+        for lock in self.locks:
+            waits = lock.waits.summary()
+            holds = lock.holds.summary()
+            lines.append(f"Lock {lock.stats()}, hold p99 {holds.get('p99', 0.0):.3f} ms, "
+                         f"recent wait p99 {waits.get('p99', 0.0):.3f} ms")
+        return lines
+
+    def text(self):
+        lines = [f"ticks {self.ticks}", f"overruns {self.overruns}", f"clients {self.clients}"]
+        for name, hist in self.histograms.items():
+            for field, value in hist.summary().items():
+                lines.append(f"{name}_{field} {value:g}")
+        for lock in self.locks:
+            for kind, hist in (("wait_ms", lock.waits), ("hold_ms", lock.holds)):
+                for field, value in hist.summary().items():
+                    lines.append(f"lock_{lock.name}_{kind}_{field} {value:g}")
+        for pid, total in list(self.bytes_sent.items()):
+            lines.append(f"client_{pid}_bytes_sent {total}")
+            lines.append(f"client_{pid}_frames_skipped {self.frames_skipped.get(pid, 0)}")
+        return "\n".join(lines) + "\n"
+
+
+def serve_stats(metrics, port, host="127.0.0.1"):
+    # GET / for plaintext, GET /json for the full report with buckets
+    class StatsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith("/json"):
+                body = json.dumps(metrics.as_dict(), indent=2).encode()
+                content_type = "application/json"
+            else:
+                body = metrics.text().encode()
+                content_type = "text/plain"
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), StatsHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Stats on http://{host}:{port}/ (plaintext) and /json")
+    return server
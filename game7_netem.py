@@ -0,0 +1,241 @@
+import argparse
+import asyncio
+from collections import deque
+import random
+import socket
+
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 21001
+LISTEN_PORT = 21002
+# idle UDP sessions are forgotten after this many seconds
+UDP_SESSION_TIMEOUT = 30.0
+
+
+class Link:
+    # one direction of the emulated path, shared by every TCP connection and
+    # UDP session so the bandwidth cap behaves like a single bottleneck
+    def __init__(self, name, latency, jitter, bandwidth, loss, retransmit, rng):
+        self.name = name
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.loss = loss
+        self.retransmit = retransmit
+        self.rng = rng
+        self.busy_until = 0.0
+        self.queued_packets = 0
+        self.queued_bytes = 0
+        self.max_queued_packets = 0
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.bytes = 0
+        self.packets = 0
+        self.dropped = 0
+        self.retransmitted = 0
+        self.max_queued_packets = self.queued_packets
+
+    def schedule(self, now, size, reliable, after=0.0):
+        # returns when the data comes out of the far end, or None if lost.
+        # A lost TCP segment arrives one retransmit timeout late, and since
+        # the caller passes the previous due time as `after`, everything
+        # behind it waits too, like real head-of-line blocking
+        penalty = 0.0
+        if self.loss and self.rng.random() < self.loss:
+            if not reliable:
+                self.dropped += 1
+                return None
+            self.retransmitted += 1
+            penalty = self.retransmit
+        start = max(now, self.busy_until)
+        if self.bandwidth:
+            self.busy_until = start + size * 8 / self.bandwidth
+            start = self.busy_until
+        due = max(start + self.latency + self.rng.uniform(0, self.jitter) + penalty, after)
+        self.queued_packets += 1
+        self.queued_bytes += size
+        self.max_queued_packets = max(self.max_queued_packets, self.queued_packets)
+        return due
+
+    def delivered(self, size):
+        self.queued_packets -= 1
+        self.queued_bytes -= size
+        self.bytes += size
+        self.packets += 1
+
+    def report(self, interval):
+        line = (f"{self.name}: {self.bytes / interval / 1024:7.1f} KiB/s {self.packets / interval:6.0f} pkt/s  "
+                f"dropped {self.dropped}  retransmitted {self.retransmitted}  "
+                f"queue {self.queued_packets} pkt / {self.queued_bytes} B (max {self.max_queued_packets})")
+        self.reset_counters()
+        return line
+
+
+def deliver_tcp(writer, queue, link):
+    # the single timer of a stream: writes every segment that is due, in
+    # stream order, then re-arms for the next one. asyncio does not keep
+    # equal-time timers in FIFO order, so segments never get one each
+    loop = asyncio.get_running_loop()
+    while queue:
+        due, data = queue[0]
+        if due > loop.time():
+            loop.call_at(due, deliver_tcp, writer, queue, link)
+            return
+        queue.popleft()
+        if data is None:
+            writer.close()
+            return
+        link.delivered(len(data))
+        if not writer.is_closing():
+            writer.write(data)
+
+
+async def pump(reader, writer, link):
+    loop = asyncio.get_running_loop()
+    queue = deque()
+    last_due = 0.0
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            last_due = link.schedule(loop.time(), len(data), reliable=True, after=last_due)
+            queue.append((last_due, data))
+            if len(queue) == 1:
+                loop.call_at(last_due, deliver_tcp, writer, queue, link)
+    except ConnectionError:
+        pass
+    # close only once everything already in flight has been delivered
+    queue.append((max(last_due, loop.time()), None))
+    if len(queue) == 1:
+        loop.call_at(queue[0][0], deliver_tcp, writer, queue, link)
+
+
+async def handle_tcp(client_reader, client_writer, args, up, down):
+    try:
+        server_reader, server_writer = await asyncio.open_connection(args.server_host, args.server_port)
+    except OSError as e:
+        print(f"Could not reach server: {e}")
+        client_writer.close()
+        return
+    for writer in (client_writer, server_writer):
+        writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    await asyncio.gather(pump(client_reader, server_writer, up), pump(server_reader, client_writer, down))
+
+
+class UpstreamProtocol(asyncio.DatagramProtocol):
+    def __init__(self, proxy, client_addr):
+        self.proxy = proxy
+        self.client_addr = client_addr
+        self.transport = None
+        self.last_seen = 0.0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.proxy.forward(self.proxy.down, self.proxy.transport, data, self.client_addr)
+
+
+class UdpProxy(asyncio.DatagramProtocol):
+    def __init__(self, args, up, down):
+        self.args = args
+        self.up = up
+        self.down = down
+        self.transport = None
+        self.sessions = {}
+        # datagrams that arrive while a client's upstream socket is opening
+        self.opening = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        session = self.sessions.get(addr)
+        if session is not None:
+            session.last_seen = asyncio.get_running_loop().time()
+            self.forward(self.up, session.transport, data, None)
+        elif addr in self.opening:
+            self.opening[addr].append(data)
+        else:
+            self.opening[addr] = [data]
+            asyncio.ensure_future(self.open_session(addr))
+
+    async def open_session(self, addr):
+        # one upstream socket per client, so replies can be routed back
+        loop = asyncio.get_running_loop()
+        _, session = await loop.create_datagram_endpoint(
+            lambda: UpstreamProtocol(self, addr), remote_addr=(self.args.server_host, self.args.server_port))
+        session.last_seen = loop.time()
+        self.sessions[addr] = session
+        for data in self.opening.pop(addr):
+            self.forward(self.up, session.transport, data, None)
+
+    def forward(self, link, transport, data, addr):
+        loop = asyncio.get_running_loop()
+        due = link.schedule(loop.time(), len(data), reliable=False)
+        if due is not None:
+            loop.call_at(due, self.deliver, link, transport, data, addr)
+
+    def deliver(self, link, transport, data, addr):
+        link.delivered(len(data))
+        if not transport.is_closing():
+            transport.sendto(data, addr)
+
+    def expire(self, now):
+        for addr, session in list(self.sessions.items()):
+            if now - session.last_seen > UDP_SESSION_TIMEOUT:
+                session.transport.close()
+                del self.sessions[addr]
+
+
+async def report_loop(interval, up, down, udp):
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        print(up.report(interval))
+        print(down.report(interval))
+        udp.expire(loop.time())
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    # both directions get the same conditions; latency is one-way
+    settings = (args.latency / 1e3, args.jitter / 1e3, args.bandwidth * 1000, args.loss, args.retransmit / 1e3, rng)
+    up = Link("client->server", *settings)
+    down = Link("server->client", *settings)
+
+    loop = asyncio.get_running_loop()
+    tcp = await asyncio.start_server(lambda r, w: handle_tcp(r, w, args, up, down), args.host, args.port,
+                                     reuse_address=True)
+    _, udp = await loop.create_datagram_endpoint(lambda: UdpProxy(args, up, down), local_addr=(args.host, args.port))
+    bandwidth = f"{args.bandwidth:g} kbit/s" if args.bandwidth else "unlimited"
+    print(f"Proxying {args.host}:{args.port} -> {args.server_host}:{args.server_port} (tcp+udp), "
+          f"latency {args.latency:g} ms +{args.jitter:g} ms, bandwidth {bandwidth}, loss {args.loss:.0%}")
+    async with tcp:
+        await asyncio.gather(tcp.serve_forever(), report_loop(args.interval, up, down, udp))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Network condition emulator proxy for game7")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=LISTEN_PORT, help="port clients connect to")
+    parser.add_argument("--server-host", default=SERVER_HOST)
+    parser.add_argument("--server-port", type=int, default=SERVER_PORT)
+    parser.add_argument("--latency", type=float, default=50.0, help="one-way delay in ms")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random one-way delay in ms")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="kbit/s per direction, 0 for unlimited")
+    parser.add_argument("--loss", type=float, default=0.0,
+                        help="drop fraction; UDP datagrams are dropped, TCP segments are delayed by --retransmit")
+    parser.add_argument("--retransmit", type=float, default=200.0, help="TCP retransmit timeout in ms")
+    parser.add_argument("--interval", type=float, default=2.0, help="seconds between throughput reports")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
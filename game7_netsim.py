@@ -0,0 +1,77 @@
+import heapq
+import itertools
+import random
+import time
+from threading import Condition, Thread
+
+
+class LossyLink:
+    # wraps the sending side of a UDP socket with simulated packet loss and
+    # one-way delay/jitter, so UDP mode can be exercised on localhost.
+    # Jitter can reorder datagrams, just like a real network
+    def __init__(self, sock, loss=0.0, delay=0.0, jitter=0.0, rng=None):
+        self.sock = sock
+        self.loss = loss
+        self.delay = delay
+        self.jitter = jitter
+        self.rng = rng or random.Random()
+        self.sent = 0
+        self.dropped = 0
+        self.queue = []
+        self.order = itertools.count()
+        self.cond = Condition()
+        self.closed = False
+        self.thread = None
+        if delay or jitter:
+            self.thread = Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def sendto(self, data, addr=None):
+        self.sent += 1
+        if self.loss and self.rng.random() < self.loss:
+            self.dropped += 1
+            return
+        if self.thread is None:
+            self._send(data, addr)
+            return
+        due = time.monotonic() + self.delay + self.rng.uniform(0, self.jitter)
+        with self.cond:
+            heapq.heappush(self.queue, (due, next(self.order), data, addr))
+            self.cond.notify()
+
+    def _send(self, data, addr):
+        try:
+            if addr is None:
+                self.sock.send(data)
+            else:
+                self.sock.sendto(data, addr)
+        except OSError:
+            pass  # UDP gives no delivery guarantee anyway
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.closed and (not self.queue or self.queue[0][0] > time.monotonic()):
+                    self.cond.wait(self.queue[0][0] - time.monotonic() if self.queue else None)
+                if self.closed:
+                    return
+                _, _, data, addr = heapq.heappop(self.queue)
+            self._send(data, addr)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+    def stats(self):
+        return f"{self.sent} datagrams sent, {self.dropped} dropped by the loss simulator"
+
+
+def link_options(args):
+    # --loss=0.1 --delay=0.05 --jitter=0.02 (fractions and seconds)
+    options = {}
+    for arg in args:
+        for name in ("loss", "delay", "jitter"):
+            if arg.startswith(f"--{name}="):
+                options[name] = float(arg.split("=", 1)[1])
+    return options
@@ -0,0 +1,375 @@
+import struct
+
+VERSION = 3
+
+MSG_ACTIONS = 1
+MSG_STATE = 2
+MSG_WELCOME = 3
+MSG_INPUT = 4
+MSG_DELTA = 5
+MSG_COMMAND = 6
+MSG_JOIN = 7
+MSG_LEAVE = 8
+MSG_INPUTS = 9
+
+ACTION_BITS = {"left": 1, "right": 2, "up": 4, "down": 8}
+
+HEADER = struct.Struct('<BB')
+ACTIONS = struct.Struct('<BBB')
+WELCOME = struct.Struct('<BBI')
+STATE_HEADER = struct.Struct('<BBII')
+SNAPSHOT_HEADER = struct.Struct('<HH')
+PLAYER_RECORD = struct.Struct('<IffiI')
+NPC_RECORD = struct.Struct('<IffH')
+FRAME_HEADER = struct.Struct('<I')
+INPUT = struct.Struct('<BBBI')
+COMMAND = struct.Struct('<BBBII')
+INPUTS_HEADER = struct.Struct('<BBIB')
+DELTA_HEADER = struct.Struct('<BBIII')
+DELTA_SECTION = struct.Struct('<HH')
+ENTITY_HEAD = struct.Struct('<IB')
+ENTITY_ID = struct.Struct('<I')
+
+# delta field layouts, in the order of the quantized entity tuples
+COORD = struct.Struct('<H')
+PLAYER_FIELDS = (COORD, COORD, struct.Struct('<i'), struct.Struct('<I'))
+NPC_FIELDS = (COORD, COORD, struct.Struct('<H'))
+QUANT_SCALE = 4
+
+RECV_BUFFER_SIZE = 65536
+MAX_DATAGRAM_SIZE = 65507
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def check_header(data, msg_type):
+    if len(data) < HEADER.size:
+        raise ProtocolError(f"Message too short: {len(data)} bytes")
+    version, kind = HEADER.unpack_from(data)
+    if version != VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}")
+    if kind != msg_type:
+        raise ProtocolError(f"Expected message type {msg_type}, got {kind}")
+
+
+def encode_actions(actions):
+    mask = 0
+    for name, bit in ACTION_BITS.items():
+        if actions.get(name):
+            mask |= bit
+    return ACTIONS.pack(VERSION, MSG_ACTIONS, mask)
+
+
+def decode_actions(data):
+    check_header(data, MSG_ACTIONS)
+    _, _, mask = ACTIONS.unpack_from(data)
+    return {name: 1 for name, bit in ACTION_BITS.items() if mask & bit}
+
+
+def encode_input(actions, ack):
+    return INPUT.pack(VERSION, MSG_INPUT, encode_actions(actions)[2], ack)
+
+
+def decode_input(data):
+    check_header(data, MSG_INPUT)
+    _, _, mask, ack = INPUT.unpack_from(data)
+    return {name: 1 for name, bit in ACTION_BITS.items() if mask & bit}, ack
+
+
+def encode_command(actions, seq, ack=0):
+    # one simulation step of input; the server reports the last seq it
+    # applied in each player record so the client can reconcile
+    return COMMAND.pack(VERSION, MSG_COMMAND, encode_actions(actions)[2], seq, ack)
+
+
+def decode_command(data):
+    check_header(data, MSG_COMMAND)
+    _, _, mask, seq, ack = COMMAND.unpack_from(data)
+    return {name: 1 for name, bit in ACTION_BITS.items() if mask & bit}, seq, ack
+
+
+def encode_inputs(commands):
+    # UDP input packet: the last few (seq, actions) commands, oldest first and
+    # with consecutive seqs, so one lost datagram loses no input
+    newest = commands[-1][0]
+    masks = bytes(encode_actions(actions)[2] for _, actions in commands)
+    return INPUTS_HEADER.pack(VERSION, MSG_INPUTS, newest, len(commands)) + masks
+
+
+def decode_inputs(data):
+    check_header(data, MSG_INPUTS)
+    _, _, newest, count = INPUTS_HEADER.unpack_from(data)
+    masks = data[INPUTS_HEADER.size:INPUTS_HEADER.size + count]
+    if len(masks) < count:
+        raise ProtocolError(f"Truncated inputs: expected {count} commands, got {len(masks)}")
+    first = newest - count + 1
+    return [(first + i, {name: 1 for name, bit in ACTION_BITS.items() if mask & bit})
+            for i, mask in enumerate(masks)]
+
+
+def encode_join():
+    return HEADER.pack(VERSION, MSG_JOIN)
+
+
+def encode_leave():
+    return HEADER.pack(VERSION, MSG_LEAVE)
+
+
+def message_type(data):
+    if len(data) < HEADER.size:
+        raise ProtocolError(f"Message too short: {len(data)} bytes")
+    return HEADER.unpack_from(data)[1]
+
+
+def encode_welcome(pid):
+    return WELCOME.pack(VERSION, MSG_WELCOME, pid)
+
+
+def decode_welcome(data):
+    check_header(data, MSG_WELCOME)
+    return WELCOME.unpack_from(data)[2]
+
+
+def encode_snapshot(players, npcs):
+    buf = bytearray(SNAPSHOT_HEADER.size + PLAYER_RECORD.size * len(players) + NPC_RECORD.size * len(npcs))
+    SNAPSHOT_HEADER.pack_into(buf, 0, len(players), len(npcs))
+    offset = SNAPSHOT_HEADER.size
+    for pid, x, y, score, input_seq in players:
+        PLAYER_RECORD.pack_into(buf, offset, pid, x, y, score, input_seq)
+        offset += PLAYER_RECORD.size
+    for nid, x, y, r in npcs:
+        NPC_RECORD.pack_into(buf, offset, nid, x, y, r)
+        offset += NPC_RECORD.size
+    return bytes(buf)
+
+
+def encode_state_header(self_id, tick=0):
+    return STATE_HEADER.pack(VERSION, MSG_STATE, self_id, tick)
+
+
+def encode_state(self_id, players, npcs, tick=0):
+    return encode_state_header(self_id, tick) + encode_snapshot(players, npcs)
+
+
+def decode_state(data):
+    check_header(data, MSG_STATE)
+    _, _, self_id, tick = STATE_HEADER.unpack_from(data)
+    offset = STATE_HEADER.size
+    n_players, n_npcs = SNAPSHOT_HEADER.unpack_from(data, offset)
+    offset += SNAPSHOT_HEADER.size
+    players_end = offset + PLAYER_RECORD.size * n_players
+    npcs_end = players_end + NPC_RECORD.size * n_npcs
+    if len(data) < npcs_end:
+        raise ProtocolError(f"Truncated state: expected {npcs_end} bytes, got {len(data)}")
+    view = memoryview(data)
+    players = [{"id": pid, "x": x, "y": y, "score": score, "input_seq": input_seq}
+               for pid, x, y, score, input_seq in PLAYER_RECORD.iter_unpack(view[offset:players_end])]
+    npcs = [{"id": nid, "x": x, "y": y, "r": r}
+            for nid, x, y, r in NPC_RECORD.iter_unpack(view[players_end:npcs_end])]
+    return {"self": self_id, "tick": tick, "players": players, "npcs": npcs}
+
+
+def encode_frame(payload):
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def frame_parts(*parts):
+    return [FRAME_HEADER.pack(sum(len(part) for part in parts)), *parts]
+
+
+def quantize(value):
+    return max(0, min(0xFFFF, int(round(value * QUANT_SCALE))))
+
+
+def dequantize(value):
+    return value / QUANT_SCALE
+
+
+def _encode_section(buf, base, current, fields):
+    full_mask = (1 << len(fields)) - 1
+    changed = []
+    for eid, values in current.items():
+        old = base.get(eid)
+        if old is None:
+            mask = full_mask
+        else:
+            mask = 0
+            for i in range(len(fields)):
+                if old[i] != values[i]:
+                    mask |= 1 << i
+        if mask:
+            changed.append((eid, mask, values))
+    removed = [eid for eid in base if eid not in current]
+    buf += DELTA_SECTION.pack(len(changed), len(removed))
+    for eid, mask, values in changed:
+        buf += ENTITY_HEAD.pack(eid, mask)
+        for i, field in enumerate(fields):
+            if mask & (1 << i):
+                buf += field.pack(values[i])
+    for eid in removed:
+        buf += ENTITY_ID.pack(eid)
+
+
+def _decode_section(data, offset, base, fields):
+    entities = dict(base)
+    n_changed, n_removed = DELTA_SECTION.unpack_from(data, offset)
+    offset += DELTA_SECTION.size
+    for _ in range(n_changed):
+        eid, mask = ENTITY_HEAD.unpack_from(data, offset)
+        offset += ENTITY_HEAD.size
+        values = list(entities.get(eid, (0,) * len(fields)))
+        for i, field in enumerate(fields):
+            if mask & (1 << i):
+                values[i] = field.unpack_from(data, offset)[0]
+                offset += field.size
+        entities[eid] = tuple(values)
+    for _ in range(n_removed):
+        (eid,) = ENTITY_ID.unpack_from(data, offset)
+        offset += ENTITY_ID.size
+        entities.pop(eid, None)
+    return entities, offset
+
+
+def encode_delta(self_id, seq, base_seq, base, current):
+    # base and current are (players, npcs) dicts of id -> quantized field
+    # tuples; base_seq 0 marks a keyframe against an empty baseline
+    buf = bytearray(DELTA_HEADER.pack(VERSION, MSG_DELTA, self_id, seq, base_seq))
+    _encode_section(buf, base[0], current[0], PLAYER_FIELDS)
+    _encode_section(buf, base[1], current[1], NPC_FIELDS)
+    return bytes(buf)
+
+
+def apply_delta(data, baselines):
+    check_header(data, MSG_DELTA)
+    _, _, self_id, seq, base_seq = DELTA_HEADER.unpack_from(data)
+    if base_seq == 0:
+        base = ({}, {})
+    elif base_seq in baselines:
+        base = baselines[base_seq]
+    else:
+        raise ProtocolError(f"Missing delta baseline {base_seq}")
+    try:
+        players, offset = _decode_section(data, DELTA_HEADER.size, base[0], PLAYER_FIELDS)
+        npcs, offset = _decode_section(data, offset, base[1], NPC_FIELDS)
+    except struct.error as e:
+        raise ProtocolError(f"Truncated delta: {e}")
+    return self_id, seq, (players, npcs)
+
+
+def delta_state(self_id, seq, entities):
+    players, npcs = entities
+    return {"self": self_id,
+            "tick": seq,
+            "players": [{"id": pid, "x": dequantize(x), "y": dequantize(y), "score": score, "input_seq": input_seq}
+                        for pid, (x, y, score, input_seq) in players.items()],
+            "npcs": [{"id": nid, "x": dequantize(x), "y": dequantize(y), "r": r} for nid, (x, y, r) in npcs.items()]}
+
+
+def send_frame(sock, *parts):
+    if len(parts) == 1 or not hasattr(sock, "sendmsg"):
+        sock.sendall(encode_frame(b"".join(parts)))
+        return
+    # scatter-gather send so a shared snapshot body is never copied per client
+    buffers = [memoryview(part) for part in frame_parts(*parts)]
+    while buffers:
+        sent = sock.sendmsg(buffers)
+        while sent:
+            if sent >= len(buffers[0]):
+                sent -= len(buffers.pop(0))
+            else:
+                buffers[0] = buffers[0][sent:]
+                sent = 0
+
+
+async def read_frame_async(reader):
+    header = await reader.readexactly(FRAME_HEADER.size)
+    (length,) = FRAME_HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame too large: {length} bytes")
+    return await reader.readexactly(length)
+
+
+class FrameReader:
+    def __init__(self, sock, buffer_size=RECV_BUFFER_SIZE, initial=b""):
+        # initial holds bytes already read off the socket elsewhere, e.g. by
+        # a process that handed the connection over
+        self.sock = sock
+        self.buf = bytearray(max(buffer_size, len(initial)))
+        self.view = memoryview(self.buf)
+        self.buf[:len(initial)] = initial
+        self.start = 0
+        self.end = len(initial)
+
+    def unread(self):
+        return bytes(self.view[self.start:self.end])
+
+    def _make_room(self, needed):
+        pending = self.end - self.start
+        if needed > len(self.buf):
+            buf = bytearray(max(needed, len(self.buf) * 2))
+            buf[:pending] = self.view[self.start:self.end]
+            self.view.release()
+            self.buf = buf
+            self.view = memoryview(buf)
+        else:
+            self.view[:pending] = self.view[self.start:self.end]
+        self.start = 0
+        self.end = pending
+
+    def frame_ready(self):
+        pending = self.end - self.start
+        if pending < FRAME_HEADER.size:
+            return False
+        (length,) = FRAME_HEADER.unpack_from(self.buf, self.start)
+        return pending >= FRAME_HEADER.size + length
+
+    def read_frame(self):
+        while True:
+            pending = self.end - self.start
+            needed = FRAME_HEADER.size
+            if pending >= FRAME_HEADER.size:
+                (length,) = FRAME_HEADER.unpack_from(self.buf, self.start)
+                if length > MAX_FRAME_SIZE:
+                    raise ProtocolError(f"Frame too large: {length} bytes")
+                needed += length
+                if pending >= needed:
+                    payload = bytes(self.view[self.start + FRAME_HEADER.size:self.start + needed])
+                    self.start += needed
+                    if self.start == self.end:
+                        self.start = self.end = 0
+                    return payload
+            if self.start + needed > len(self.buf):
+                self._make_room(needed)
+            received = self.sock.recv_into(self.view[self.end:])
+            if not received:
+                return None
+            self.end += received
+
+
+if __name__ == "__main__":
+    import timeit
+
+    players = [(pid, 100.0 + pid, 200.0 + pid, pid * 10, 0) for pid in range(1, 9)]
+    npcs = [(i + 1, 50.0 + i, 60.0 + i, 15) for i in range(10)]
+    state = {"self": 1,
+             "players": [{"id": p[0], "x": p[1], "y": p[2], "score": p[3], "input_seq": p[4]} for p in players],
+             "npcs": [{"id": n[0], "x": n[1], "y": n[2], "r": n[3]} for n in npcs]}
+    actions = {"left": 1, "up": 1}
+
+    n = 20000
+    repr_state = str(state).encode()
+    bin_state = encode_state(1, players, npcs)
+    t_repr = timeit.timeit(lambda: eval(str(state).encode().decode()), number=n)
+    t_bin = timeit.timeit(lambda: decode_state(encode_state(1, players, npcs)), number=n)
+    print(f"state   repr/eval: {len(repr_state):5d} B {t_repr / n * 1e6:7.2f} us/msg")
+    print(f"state   binary:    {len(bin_state):5d} B {t_bin / n * 1e6:7.2f} us/msg")
+
+    repr_actions = str(actions).encode()
+    bin_actions = encode_actions(actions)
+    t_repr = timeit.timeit(lambda: eval(str(actions).encode().decode()), number=n)
+    t_bin = timeit.timeit(lambda: decode_actions(encode_actions(actions)), number=n)
+    print(f"actions repr/eval: {len(repr_actions):5d} B {t_repr / n * 1e6:7.2f} us/msg")
+    print(f"actions binary:    {len(bin_actions):5d} B {t_bin / n * 1e6:7.2f} us/msg")
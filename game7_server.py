@@ -1,18 +1,76 @@
+import asyncio
+from collections import OrderedDict, deque, namedtuple
+from contextlib import nullcontext
+import itertools
+from multiprocessing import get_context, reduction
+from multiprocessing.connection import wait
+import os
 import socket
+import sys
 import math
 import time
 import random
-from threading import Thread, Lock
+from threading import Condition, Lock, Thread
+
+from game7_metrics import ServerMetrics, TimedLock, serve_stats
+from game7_netsim import LossyLink, link_options
+from game7_protocol import (FRAME_HEADER, MAX_DATAGRAM_SIZE, MSG_COMMAND, MSG_INPUT, MSG_INPUTS, MSG_JOIN, MSG_LEAVE,
+                            FrameReader, ProtocolError, decode_actions, decode_command, decode_input, decode_inputs,
+                            encode_delta, encode_frame, encode_leave, encode_snapshot, encode_state,
+                            encode_state_header, encode_welcome, frame_parts, message_type, quantize,
+                            read_frame_async, send_frame)
+from tick_scheduler import BEHIND_POLICIES, CATCH_UP, TickScheduler
 
 HOST = '0.0.0.0'
 PORT = 21001
 WIDTH = 800
 HEIGHT = 600
 FPS = 60
+TICK_INTERVAL = 1 / FPS
 MAX_NPCS = 10
 NPC_SPAWN_INTERVAL = 2.0
+# asyncio push mode skips a client's snapshot while this many bytes are still unsent
+MAX_PENDING_BYTES = 64 * 1024
+STATS_INTERVAL = 5.0
+# how many unacknowledged snapshots are kept per client as delta baselines
+DELTA_HISTORY = 32
+# entities enter a client's view inside AOI_RADIUS and only leave once they
+# are further than AOI_RADIUS + AOI_HYSTERESIS, so they don't flicker
+AOI_RADIUS = 300
+AOI_HYSTERESIS = 50
+# predicted clients send one command per frame and a step applies one. A
+# step that finds no command banks a credit (at most MAX_COMMAND_CREDIT) that
+# later steps spend on an extra command, so a client catches up after jitter
+# but never averages more than one command per step, however fast it sends.
+# At most MAX_QUEUED_COMMANDS wait
+MAX_COMMAND_CREDIT = 3
+MAX_QUEUED_COMMANDS = 32
+# UDP clients that send nothing for this long are dropped, in case their
+# leave message never arrived
+UDP_TIMEOUT = 5.0
+# --rooms: players per room process, and how often the lobby evens rooms out
+# once the fullest has more than REBALANCE_SLACK players over the emptiest
+ROOM_CAPACITY = 32
+REBALANCE_INTERVAL = 5.0
+REBALANCE_SLACK = 2
+
+PlayerRecord = namedtuple("PlayerRecord", "id x y score input_seq")
+NpcRecord = namedtuple("NpcRecord", "id x y radius")
+
+
+game_lock = TimedLock("game_lock")
+channels_lock = TimedLock("channels_lock")
+metrics = ServerMetrics(TICK_INTERVAL, (game_lock, channels_lock))
+# client threads hand inputs to the tick through GameState.inbox and read
+# the published Snapshot, so they never take game_lock. --global-lock brings
+# back the old path where they share it with the whole tick, to compare
+# lock wait times
+global_lock = False
+NO_LOCK = nullcontext()
+
 
-game_lock = Lock()
+def state_lock():
+    return game_lock if global_lock else NO_LOCK
 
 
 class Player:
@@ -30,13 +88,17 @@ class Player:
         self.x = max(self.radius, min(WIDTH - self.radius, self.x))
         self.y = max(self.radius, min(HEIGHT - self.radius, self.y))
 
+    def apply(self, actions):
+        self.move(actions.get("left", 0), actions.get("right", 0), actions.get("up", 0), actions.get("down", 0))
+
     def collides_with(self, npc):
         dist = math.sqrt((self.x - npc.x) ** 2 + (self.y - npc.y) ** 2)
         return dist < self.radius + npc.radius
 
 
 class NPC:
-    def __init__(self, x, y, vx, vy):
+    def __init__(self, nid, x, y, vx, vy):
+        self.id = nid
         self.x = x
         self.y = y
         self.vx = vx
@@ -54,28 +116,141 @@ class NPC:
             self.y = max(self.radius, min(HEIGHT - self.radius, self.y))
 
 
+class Snapshot:
+    # published by the tick thread after every update and never changed
+    # afterwards, so client threads read it without a lock. The encoded forms
+    # are filled in lazily; threads racing on the same field compute
+    # identical values, so the race is harmless
+    hits = 0
+    misses = 0
+
+    def __init__(self, tick, players, npcs):
+        self.tick = tick
+        self.players = players
+        self.npcs = npcs
+        self.players_by_id = {p.id: p for p in players}
+        self.body = None
+        self.entities = None
+        self.grid = None
+
+    def shared_body(self):
+        body = self.body
+        if body is None:
+            Snapshot.misses += 1
+            start = time.perf_counter()
+            body = self.body = encode_snapshot(self.players, self.npcs)
+            metrics.observe("snapshot_encode_ms", time.perf_counter() - start)
+        else:
+            Snapshot.hits += 1
+        return body
+
+    def shared_entities(self):
+        entities = self.entities
+        if entities is None:
+            Snapshot.misses += 1
+            start = time.perf_counter()
+            players = {p.id: (quantize(p.x), quantize(p.y), p.score, p.input_seq) for p in self.players}
+            npcs = {n.id: (quantize(n.x), quantize(n.y), n.radius) for n in self.npcs}
+            entities = self.entities = (players, npcs)
+            metrics.observe("snapshot_encode_ms", time.perf_counter() - start)
+        else:
+            Snapshot.hits += 1
+        return entities
+
+    def interest_grid(self):
+        grid = self.grid
+        if grid is None:
+            grid = InterestGrid(AOI_RADIUS + AOI_HYSTERESIS)
+            grid.build(self.players, self.npcs)
+            self.grid = grid
+        return grid
+
+    def broadcast_payload(self):
+        # self id 0 means the client takes its id from the welcome message
+        return encode_state_header(0, self.tick) + self.shared_body()
+
+    def broadcast_frame(self):
+        return encode_frame(self.broadcast_payload())
+
+    def build_reply(self, pid, tracker=None, interest=None):
+        if interest is not None:
+            players, npcs = interest.select(self.interest_grid(), self.players_by_id.get(pid))
+        if tracker is not None:
+            entities = self.shared_entities()
+            if interest is not None:
+                entities = ({p.id: entities[0][p.id] for p in players}, {n.id: entities[1][n.id] for n in npcs})
+            return (tracker.encode(pid, self.tick, entities),)
+        if interest is not None:
+            return (encode_state(pid, players, npcs, self.tick),)
+        return encode_state_header(pid, self.tick), self.shared_body()
+
+
 class GameState:
     def __init__(self):
         self.players = {}
         self.npcs = []
         self.actions = {}
-        self.next_player_id = 1
-        self.last_npc_spawn = time.time()
-
-    def add_player(self):
-        pid = self.next_player_id
-        self.next_player_id += 1
-        x = random.randint(100, WIDTH - 100)
-        y = random.randint(100, HEIGHT - 100)
-        self.players[pid] = Player(pid, x, y)
-        self.actions[pid] = {}
+        self.commands = {}
+        self.command_credit = {}
+        self.last_input = {}
+        # client threads only append (kind, pid, value) events here and the
+        # tick drains them, so input never waits for a running update
+        self.inbox = deque()
+        self.player_ids = itertools.count(1)
+        self.next_npc_id = 1
+        self.tick = 0
+        # simulation steps run so far; NPC spawning counts steps rather than
+        # wall-clock time so it keeps pace with the simulation
+        self.steps = 0
+        self.last_npc_spawn = 0
+        self.interests = {}
+        self.snapshot = Snapshot(0, (), ())
+
+    def add_player(self, restore=None):
+        # restore is (x, y, score, last input seq) for a player moved in
+        # from another room
+        pid = next(self.player_ids)
+        self.inbox.append(("join", pid, restore))
         return pid
 
     def remove_player(self, pid):
-        if pid in self.players:
-            del self.players[pid]
-        if pid in self.actions:
-            del self.actions[pid]
+        self.inbox.append(("leave", pid, None))
+
+    def set_actions(self, pid, actions):
+        self.inbox.append(("actions", pid, actions))
+
+    def queue_command(self, pid, actions, seq):
+        self.inbox.append(("command", pid, (seq, actions)))
+
+    def drain_inbox(self):
+        for _ in range(len(self.inbox)):
+            kind, pid, value = self.inbox.popleft()
+            if kind == "join":
+                if value is None:
+                    x = random.randint(100, WIDTH - 100)
+                    y = random.randint(100, HEIGHT - 100)
+                    self.players[pid] = Player(pid, x, y)
+                else:
+                    x, y, score, last_input = value
+                    self.players[pid] = Player(pid, x, y)
+                    self.players[pid].score = score
+                    self.last_input[pid] = last_input
+                self.actions[pid] = {}
+            elif kind == "leave":
+                self.players.pop(pid, None)
+                self.actions.pop(pid, None)
+                self.commands.pop(pid, None)
+                self.command_credit.pop(pid, None)
+                self.last_input.pop(pid, None)
+            elif pid not in self.players:
+                continue
+            elif kind == "actions":
+                self.actions[pid] = value
+            else:
+                queue = self.commands.get(pid)
+                if queue is None:
+                    queue = self.commands[pid] = deque(maxlen=MAX_QUEUED_COMMANDS)
+                queue.append(value)
 
     def spawn_npc(self):
         if len(self.npcs) >= MAX_NPCS:
@@ -91,25 +266,44 @@ class GameState:
             x, y = 20, random.randint(20, HEIGHT - 20)
         vx = random.choice([-1, 1]) * random.randint(2, 4)
         vy = random.choice([-1, 1]) * random.randint(2, 4)
-        self.npcs.append(NPC(x, y, vx, vy))
+        self.npcs.append(NPC(self.next_npc_id, x, y, vx, vy))
+        self.next_npc_id += 1
 
-    def update(self):
-        now = time.time()
-        if now - self.last_npc_spawn >= NPC_SPAWN_INTERVAL:
+    def update(self, tick, dt):
+        # a merged tick (dt of several intervals) simulates every step but
+        # publishes one snapshot
+        self.drain_inbox()
+        self.tick = tick
+        for _ in range(max(1, round(dt / TICK_INTERVAL))):
+            self.step()
+        start = time.perf_counter()
+        self.publish()
+        metrics.observe("snapshot_publish_ms", time.perf_counter() - start)
+
+    def step(self):
+        self.steps += 1
+        if self.steps - self.last_npc_spawn >= NPC_SPAWN_INTERVAL * FPS:
             self.spawn_npc()
-            self.last_npc_spawn = now
+            self.last_npc_spawn = self.steps
 
         for npc in self.npcs:
             npc.move()
 
         for pid, player in self.players.items():
-            act = self.actions.get(pid, {})
-            player.move(
-                act.get("left", 0),
-                act.get("right", 0),
-                act.get("up", 0),
-                act.get("down", 0)
-            )
+            queue = self.commands.get(pid)
+            if queue is None:
+                player.apply(self.actions.get(pid, {}))
+                continue
+            credit = self.command_credit.get(pid, 0)
+            if not queue:
+                self.command_credit[pid] = min(credit + 1, MAX_COMMAND_CREDIT)
+                continue
+            extra = min(len(queue) - 1, credit)
+            self.command_credit[pid] = credit - extra
+            for _ in range(1 + extra):
+                seq, act = queue.popleft()
+                player.apply(act)
+                self.last_input[pid] = seq
 
         for pid, player in self.players.items():
             for npc in self.npcs[:]:
@@ -117,44 +311,311 @@ class GameState:
                     player.score += 10
                     self.npcs.remove(npc)
 
-    def get_state_for_client(self, pid):
-        players_data = []
-        for p in self.players.values():
-            players_data.append({"id": p.id, "x": p.x, "y": p.y, "score": p.score})
-        npcs_data = []
-        for n in self.npcs:
-            npcs_data.append({"x": n.x, "y": n.y, "r": n.radius})
-        return {"self": pid, "players": players_data, "npcs": npcs_data}
+    def publish(self):
+        players = tuple(PlayerRecord(p.id, p.x, p.y, p.score, self.last_input.get(p.id, 0))
+                        for p in self.players.values())
+        npcs = tuple(NpcRecord(n.id, n.x, n.y, n.radius) for n in self.npcs)
+        self.snapshot = Snapshot(self.tick, players, npcs)
+
+    def cache_stats(self):
+        return f"Snapshot cache: {Snapshot.hits} hits, {Snapshot.misses} misses"
+
+    def aoi_stats(self):
+        counts = " ".join(f"{pid}:{interest.count}" for pid, interest in list(self.interests.items()))
+        return f"AOI entities sent per client: {counts}"
+
+
+class InterestGrid:
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+
+    def cell_of(self, x, y):
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    def build(self, players, npcs):
+        for player in players:
+            self.cells.setdefault(self.cell_of(player.x, player.y), ([], []))[0].append(player)
+        for npc in npcs:
+            self.cells.setdefault(self.cell_of(npc.x, npc.y), ([], []))[1].append(npc)
+
+    def query(self, x, y):
+        cx, cy = self.cell_of(x, y)
+        players, npcs = [], []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                cell = self.cells.get((cx + dx, cy + dy))
+                if cell:
+                    players.extend(cell[0])
+                    npcs.extend(cell[1])
+        return players, npcs
+
+
+class AreaOfInterest:
+    def __init__(self, radius=AOI_RADIUS, hysteresis=AOI_HYSTERESIS):
+        self.enter_sq = radius ** 2
+        self.leave_sq = (radius + hysteresis) ** 2
+        self.visible_players = set()
+        self.visible_npcs = set()
+        self.count = 0
+
+    def _filter(self, entities, visible, x, y):
+        kept = []
+        for e in entities:
+            dist_sq = (e.x - x) ** 2 + (e.y - y) ** 2
+            if dist_sq <= self.enter_sq or (dist_sq <= self.leave_sq and e.id in visible):
+                kept.append(e)
+        # ids grow in spawn order, so sorting keeps the server's entity order
+        kept.sort(key=lambda e: e.id)
+        visible.clear()
+        visible.update(e.id for e in kept)
+        return kept
+
+    def select(self, grid, me):
+        if me is None:
+            return [], []
+        players, npcs = grid.query(me.x, me.y)
+        players = self._filter(players, self.visible_players, me.x, me.y)
+        npcs = self._filter(npcs, self.visible_npcs, me.x, me.y)
+        self.count = len(players) + len(npcs)
+        return players, npcs
+
+
+class ClientChannel:
+    def __init__(self, conn, pid):
+        self.conn = conn
+        self.pid = pid
+        self.cond = Condition()
+        self.pending = None
+        self.closed = False
+
+    def publish(self, frame):
+        with self.cond:
+            if self.pending is not None:
+                metrics.skipped(self.pid)
+            self.pending = frame
+            self.cond.notify()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+    def run_writer(self):
+        while True:
+            with self.cond:
+                while self.pending is None and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                frame, self.pending = self.pending, None
+            try:
+                self.conn.sendall(frame)
+            except OSError:
+                return
+            metrics.add_bytes(self.pid, len(frame))
+
+
+class DeltaTracker:
+    def __init__(self, history=DELTA_HISTORY):
+        self.history = history
+        self.sent = OrderedDict()
+        self.acked = 0
+
+    def ack(self, seq):
+        if seq == 0 or seq in self.sent:
+            self.acked = seq
+        while self.sent and next(iter(self.sent)) < self.acked:
+            self.sent.popitem(last=False)
+
+    def encode(self, pid, seq, entities):
+        base = self.sent.get(self.acked) if self.acked else None
+        if base is None:
+            data = encode_delta(pid, seq, 0, ({}, {}), entities)
+        else:
+            data = encode_delta(pid, seq, self.acked, base, entities)
+        self.sent[seq] = entities
+        while len(self.sent) > self.history:
+            self.sent.popitem(last=False)
+        return data
+
+
+class UdpClient:
+    def __init__(self, pid):
+        self.pid = pid
+        self.last_seq = 0
+        self.last_seen = time.time()
+
+
+class UdpServer:
+    # snapshots go out unreliably every tick; join and leave are made
+    # reliable by the client resending them until it gets an answer, which
+    # the server gives for every copy it receives
+    def __init__(self, sock, link):
+        self.sock = sock
+        self.link = link
+        self.clients = {}
+
+    def serve(self):
+        self.sock.settimeout(1.0)
+        last_expire = time.time()
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(MAX_DATAGRAM_SIZE)
+            except socket.timeout:
+                data = None
+            except OSError:
+                continue  # ICMP errors from clients that went away
+            if data is not None:
+                try:
+                    self.receive(data, addr)
+                except ProtocolError as e:
+                    print(f"Bad datagram from {addr}: {e}")
+            if time.time() - last_expire >= 1.0:
+                self.expire()
+                last_expire = time.time()
+
+    def receive(self, data, addr):
+        kind = message_type(data)
+        client = self.clients.get(addr)
+        if kind == MSG_JOIN:
+            if client is None:
+                client = UdpClient(game_state.add_player())
+                with channels_lock:
+                    self.clients[addr] = client
+                print(f"Player {client.pid} connected over UDP from {addr}")
+            self.link.sendto(encode_welcome(client.pid), addr)
+        elif kind == MSG_LEAVE:
+            self.link.sendto(encode_leave(), addr)
+            if client is not None:
+                self.drop(addr, client)
+        elif client is not None and kind == MSG_INPUTS:
+            client.last_seen = time.time()
+            for seq, actions in decode_inputs(data):
+                # every packet repeats recent inputs; apply each seq once
+                if seq > client.last_seq:
+                    game_state.queue_command(client.pid, actions, seq)
+                    client.last_seq = seq
+
+    def drop(self, addr, client):
+        with channels_lock:
+            self.clients.pop(addr, None)
+        game_state.remove_player(client.pid)
+        metrics.remove_client(client.pid)
+        print(f"Player {client.pid} disconnected")
+
+    def expire(self):
+        now = time.time()
+        for addr, client in list(self.clients.items()):
+            if now - client.last_seen > UDP_TIMEOUT:
+                self.drop(addr, client)
+
+    def broadcast(self, snapshot):
+        payload = snapshot.broadcast_payload()
+        with channels_lock:
+            targets = list(self.clients.items())
+        for addr, client in targets:
+            self.link.sendto(payload, addr)
+            metrics.add_bytes(client.pid, len(payload))
 
 
 game_state = GameState()
+channels = {}
+async_writers = {}
+# the RoomLink back to the lobby when this process runs one room of --rooms
+room = None
+
+
+def receive_input(pid, data, tracker=None):
+    kind = message_type(data)
+    ack = None
+    if kind == MSG_COMMAND:
+        actions, seq, ack = decode_command(data)
+        game_state.queue_command(pid, actions, seq)
+    elif kind == MSG_INPUT:
+        actions, ack = decode_input(data)
+        game_state.set_actions(pid, actions)
+    else:
+        game_state.set_actions(pid, decode_actions(data))
+    if tracker is not None and ack is not None:
+        tracker.ack(ack)
+
+
+def handle_client(conn, pid, delta=False, aoi=False, initial=b""):
+    print(f"Player {pid} connected")
+    reader = FrameReader(conn, initial=initial)
+    moved = False
+    tracker = DeltaTracker() if delta else None
+    interest = AreaOfInterest() if aoi else None
+    if interest is not None:
+        game_state.interests[pid] = interest
+    try:
+        while True:
+            data = reader.read_frame()
+            if data is None:
+                break
+            if room is not None and pid in room.leaving:
+                # the lobby is moving this client to another room; the request
+                # just read travels with the socket and is answered there
+                room.hand_back(pid, conn, encode_frame(data) + reader.unread())
+                moved = True
+                break
+            try:
+                with state_lock():
+                    receive_input(pid, data, tracker)
+                    reply = game_state.snapshot.build_reply(pid, tracker, interest)
+                send_frame(conn, *reply)
+                metrics.add_bytes(pid, FRAME_HEADER.size + sum(len(part) for part in reply))
+            except Exception as e:
+                print(f"Error processing data from player {pid}: {e}")
+                break
+    except Exception as e:
+        print(f"Connection error with player {pid}: {e}")
+    finally:
+        game_state.interests.pop(pid, None)
+        game_state.remove_player(pid)
+        metrics.remove_client(pid)
+        if moved:
+            print(f"Player {pid} moved to another room")
+        else:
+            if room is not None:
+                room.disconnected(pid)
+            print(f"Player {pid} disconnected")
 
 
-def handle_client(conn, pid):
+def handle_client_push(conn, pid):
     print(f"Player {pid} connected")
+    channel = ClientChannel(conn, pid)
+    reader = FrameReader(conn)
     try:
+        send_frame(conn, encode_welcome(pid))
+        with channels_lock:
+            channels[pid] = channel
+        Thread(target=channel.run_writer, daemon=True).start()
         while True:
-            data = conn.recv(1024)
-            if not data:
+            data = reader.read_frame()
+            if data is None:
                 break
             try:
-                actions = eval(data.decode())
-                with game_lock:
-                    game_state.actions[pid] = actions
-                    state = game_state.get_state_for_client(pid)
-                conn.sendall(str(state).encode())
+                with state_lock():
+                    receive_input(pid, data)
             except Exception as e:
                 print(f"Error processing data from player {pid}: {e}")
                 break
     except Exception as e:
         print(f"Connection error with player {pid}: {e}")
     finally:
-        with game_lock:
-            game_state.remove_player(pid)
+        with channels_lock:
+            channels.pop(pid, None)
+        channel.close()
+        game_state.remove_player(pid)
+        metrics.remove_client(pid)
+        if room is not None:
+            room.disconnected(pid)
         print(f"Player {pid} disconnected")
 
 
-def accept_connections():
+def accept_connections(push=False, delta=False, aoi=False):
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     s.bind((HOST, PORT))
@@ -162,18 +623,378 @@ def accept_connections():
     print(f"Server listening on {HOST}:{PORT}")
     while True:
         conn, addr = s.accept()
-        with game_lock:
-            pid = game_state.add_player()
-        Thread(target=handle_client, args=(conn, pid), daemon=True).start()
+        start_client(conn, game_state.add_player(), push, delta, aoi)
+
+
+def start_client(conn, pid, push=False, delta=False, aoi=False, initial=b""):
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if push:
+        Thread(target=handle_client_push, args=(conn, pid), daemon=True).start()
+    else:
+        Thread(target=handle_client, args=(conn, pid, delta, aoi, initial), daemon=True).start()
+
+
+def broadcast_snapshot(snapshot):
+    # one encoded frame per tick, shared by every client
+    frame = snapshot.broadcast_frame()
+    with channels_lock:
+        targets = list(channels.values())
+    for channel in targets:
+        channel.publish(frame)
+
+
+def serve_udp(options):
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.bind((HOST, PORT))
+    server = UdpServer(s, LossyLink(s, **options))
+    Thread(target=server.serve, daemon=True).start()
+    print(f"Server listening on {HOST}:{PORT} (udp)")
+    return server
 
 
-def game_loop():
+def game_loop(push=False, udp=None, behind=CATCH_UP):
+    scheduler = TickScheduler(FPS, behind)
+    last_stats = time.time()
     while True:
-        with game_lock:
-            game_state.update()
-        time.sleep(1 / FPS)
+        tick, dt = scheduler.wait()
+        start = time.perf_counter()
+        with state_lock():
+            game_state.update(tick, dt)
+        metrics.tick(start, time.perf_counter() - start, len(game_state.players), scheduler.lateness)
+        broadcast_start = time.perf_counter()
+        if push:
+            broadcast_snapshot(game_state.snapshot)
+        if udp is not None:
+            udp.broadcast(game_state.snapshot)
+        metrics.observe("broadcast_ms", time.perf_counter() - broadcast_start)
+        if time.time() - last_stats >= STATS_INTERVAL:
+            if udp is not None:
+                print(f"UDP: {udp.link.stats()}")
+            elif not push:
+                print(game_state.cache_stats())
+            if game_state.interests:
+                print(game_state.aoi_stats())
+            for line in metrics.log_lines():
+                print(line)
+            print(scheduler.stats())
+            if room is not None:
+                print(room.stats())
+            last_stats = time.time()
+
+
+async def handle_client_async(reader, writer, push=False, delta=False, aoi=False):
+    writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    pid = game_state.add_player()
+    tracker = DeltaTracker() if delta else None
+    interest = AreaOfInterest() if aoi else None
+    if interest is not None:
+        game_state.interests[pid] = interest
+    print(f"Player {pid} connected")
+    try:
+        if push:
+            writer.write(encode_frame(encode_welcome(pid)))
+            async_writers[pid] = writer
+        while True:
+            try:
+                data = await read_frame_async(reader)
+            except asyncio.IncompleteReadError:
+                break
+            try:
+                receive_input(pid, data, tracker)
+                if push:
+                    continue
+                parts = frame_parts(*game_state.snapshot.build_reply(pid, tracker, interest))
+                writer.writelines(parts)
+                metrics.add_bytes(pid, sum(len(part) for part in parts))
+                await writer.drain()
+            except Exception as e:
+                print(f"Error processing data from player {pid}: {e}")
+                break
+    except Exception as e:
+        print(f"Connection error with player {pid}: {e}")
+    finally:
+        async_writers.pop(pid, None)
+        game_state.interests.pop(pid, None)
+        game_state.remove_player(pid)
+        metrics.remove_client(pid)
+        writer.close()
+        print(f"Player {pid} disconnected")
+
+
+async def game_loop_async(push=False, behind=CATCH_UP):
+    scheduler = TickScheduler(FPS, behind)
+    last_stats = time.time()
+    while True:
+        tick, dt = await scheduler.wait_async()
+        start = time.perf_counter()
+        game_state.update(tick, dt)
+        metrics.tick(start, time.perf_counter() - start, len(game_state.players), scheduler.lateness)
+        broadcast_start = time.perf_counter()
+        if push and async_writers:
+            frame = game_state.snapshot.broadcast_frame()
+            for pid, writer in async_writers.items():
+                if writer.transport.get_write_buffer_size() < MAX_PENDING_BYTES:
+                    writer.write(frame)
+                    metrics.add_bytes(pid, len(frame))
+                else:
+                    metrics.skipped(pid)
+        metrics.observe("broadcast_ms", time.perf_counter() - broadcast_start)
+        if time.time() - last_stats >= STATS_INTERVAL:
+            if not push:
+                print(game_state.cache_stats())
+            if game_state.interests:
+                print(game_state.aoi_stats())
+            for line in metrics.log_lines():
+                print(line)
+            print(scheduler.stats())
+            last_stats = time.time()
+
+
+async def serve_async(push=False, delta=False, aoi=False, behind=CATCH_UP):
+    server = await asyncio.start_server(lambda r, w: handle_client_async(r, w, push, delta, aoi), HOST, PORT,
+                                        reuse_address=True)
+    print(f"Server listening on {HOST}:{PORT} (asyncio)")
+    async with server:
+        await asyncio.gather(server.serve_forever(), game_loop_async(push, behind))
+
+
+class RoomLink:
+    # a room process's end of its pipe to the lobby. The lobby sends new
+    # connections and release requests; the room reports players leaving and
+    # hands released connections back, with the player's position, score and
+    # last input seq, so the lobby can place them elsewhere. A moved player
+    # gets a new id in its new room, whose tick counter is its own
+    def __init__(self, room_id, pipe):
+        self.room_id = room_id
+        self.pipe = pipe
+        self.send_lock = Lock()
+        self.clients = set()
+        self.leaving = set()
+
+    def serve(self, push=False, delta=False, aoi=False):
+        # returns once the lobby is gone; the lobby may die with messages
+        # still unread, which shows up as a reset rather than EOF
+        while True:
+            try:
+                kind, value = self.pipe.recv()
+            except (EOFError, OSError):
+                print(f"Room {self.room_id}: lobby went away")
+                return
+            if kind == "conn":
+                unread, player = value
+                conn = socket.socket(fileno=reduction.recv_handle(self.pipe))
+                pid = game_state.add_player(player)
+                self.clients.add(pid)
+                start_client(conn, pid, push, delta, aoi, initial=unread)
+            elif kind == "release" and not push:
+                # push clients only learn their id from the welcome message,
+                # so only request/response clients can switch rooms
+                self.leaving = set(sorted(self.clients)[-value:]) if value else set()
+
+    def hand_back(self, pid, conn, unread):
+        self.clients.discard(pid)
+        self.leaving.discard(pid)
+        # the last published snapshot: inputs queued since that tick are not
+        # carried over, and prediction corrects for them
+        record = game_state.snapshot.players_by_id.get(pid)
+        player = None if record is None else (record.x, record.y, record.score, record.input_seq)
+        try:
+            with self.send_lock:
+                self.pipe.send(("moved", (unread, player)))
+                reduction.send_handle(self.pipe, conn.fileno(), os.getppid())
+        except OSError:
+            pass  # the lobby is gone and this room is shutting down
+
+    def disconnected(self, pid):
+        if pid in self.clients:
+            self.clients.discard(pid)
+            try:
+                with self.send_lock:
+                    self.pipe.send(("left", pid))
+            except OSError:
+                pass
+
+    def stats(self):
+        return f"Room {self.room_id}: {len(self.clients)} players, {len(self.leaving)} waiting to move"
+
+
+def run_room(room_id, pipe, push, delta, aoi, behind, use_global_lock, stats_port):
+    # each room is a whole server: its own GameState, tick loop and client
+    # threads, in a process of its own so rooms run on separate cores
+    global room, global_lock
+    global_lock = use_global_lock
+    room = RoomLink(room_id, pipe)
+    if stats_port:
+        serve_stats(metrics, stats_port + room_id)
+    Thread(target=game_loop, args=(push,), kwargs={"behind": behind}, daemon=True).start()
+    print(f"Room {room_id} running in process {os.getpid()}")
+    # the lobby pipe is served on the main thread, so the room lives exactly
+    # as long as the lobby does
+    room.serve(push, delta, aoi)
+    os._exit(0)
+
+
+class RoomHandle:
+    # the lobby's view of one room process
+    def __init__(self, room_id, process, pipe):
+        self.room_id = room_id
+        self.process = process
+        self.pipe = pipe
+        self.send_lock = Lock()
+        self.players = 0
+        self.alive = True
+
+    def hand_off(self, fd, unread=b"", player=None):
+        with self.send_lock:
+            self.pipe.send(("conn", (unread, player)))
+            reduction.send_handle(self.pipe, fd, self.process.pid)
+
+    def release(self, count):
+        with self.send_lock:
+            self.pipe.send(("release", count))
+
+
+class Lobby:
+    def __init__(self, rooms, capacity=ROOM_CAPACITY, rebalance=True):
+        self.rooms = rooms
+        self.capacity = capacity
+        self.rebalance = rebalance
+        self.lock = Lock()
+
+    def place(self, fd, unread=b"", player=None, exclude=None):
+        # least loaded room with a free slot; a client being moved only goes
+        # back to the room it came from when every other room is full
+        with self.lock:
+            open_rooms = [r for r in self.rooms if r.alive and r.players < self.capacity]
+            candidates = [r for r in open_rooms if r is not exclude] or open_rooms
+            if not candidates:
+                return None
+            target = min(candidates, key=lambda r: r.players)
+            target.players += 1
+        try:
+            target.hand_off(fd, unread, player)
+        except OSError:
+            with self.lock:
+                target.players -= 1
+            return None
+        return target
+
+    def accept_connections(self):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind((HOST, PORT))
+        s.listen()
+        print(f"Lobby listening on {HOST}:{PORT}, {len(self.rooms)} rooms of {self.capacity} players")
+        while True:
+            conn, addr = s.accept()
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if self.place(conn.fileno()) is None:
+                print(f"All rooms are full, turning away {addr}")
+            # the room has its own copy of the socket now
+            conn.close()
+
+    def watch_rooms(self):
+        while True:
+            for pipe in wait([r.pipe for r in self.rooms if r.alive]):
+                source = next(r for r in self.rooms if r.pipe is pipe)
+                try:
+                    kind, value = pipe.recv()
+                    fd = reduction.recv_handle(pipe) if kind == "moved" else None
+                except (EOFError, OSError):
+                    print(f"Room {source.room_id} exited")
+                    with self.lock:
+                        source.alive = False
+                    continue
+                with self.lock:
+                    source.players -= 1
+                if fd is not None:
+                    unread, player = value
+                    if self.place(fd, unread, player, exclude=source) is None:
+                        print(f"No room for a player leaving room {source.room_id}")
+                    os.close(fd)
+
+    def rebalance_rooms(self):
+        with self.lock:
+            live = [r for r in self.rooms if r.alive]
+            if len(live) < 2:
+                return
+            fullest = max(live, key=lambda r: r.players)
+            emptiest = min(live, key=lambda r: r.players)
+            spread = fullest.players - emptiest.players
+        # a client only moves when it sends its next request, so the count
+        # is a target the room works towards, not an increment
+        fullest.release(spread // 2 if spread > REBALANCE_SLACK else 0)
+
+    def stats(self):
+        with self.lock:
+            rooms = " ".join(f"{r.room_id}:{r.players}/{self.capacity}" if r.alive else f"{r.room_id}:down"
+                             for r in self.rooms)
+        return f"Rooms: {rooms}"
+
+    def run(self):
+        Thread(target=self.accept_connections, daemon=True).start()
+        Thread(target=self.watch_rooms, daemon=True).start()
+        last_stats = time.time()
+        while True:
+            time.sleep(REBALANCE_INTERVAL)
+            if self.rebalance:
+                self.rebalance_rooms()
+            if time.time() - last_stats >= STATS_INTERVAL:
+                print(self.stats())
+                last_stats = time.time()
+
+
+def serve_rooms(count, capacity=ROOM_CAPACITY, push=False, delta=False, aoi=False, behind=CATCH_UP,
+                stats_port=None):
+    # spawned rather than forked, so a room doesn't inherit the lobby's
+    # threads or the lobby ends of the other rooms' pipes
+    context = get_context("spawn")
+    rooms = []
+    for room_id in range(count):
+        lobby_end, room_end = context.Pipe()
+        process = context.Process(target=run_room, args=(room_id, room_end, push, delta, aoi, behind, global_lock,
+                                                 stats_port), daemon=True)
+        process.start()
+        room_end.close()
+        rooms.append(RoomHandle(room_id, process, lobby_end))
+    Lobby(rooms, capacity, rebalance=not push).run()
 
 
 if __name__ == "__main__":
-    Thread(target=accept_connections, daemon=True).start()
-    game_loop()
+    global_lock = "--global-lock" in sys.argv[1:]
+    push = "--push" in sys.argv[1:]
+    delta = "--delta" in sys.argv[1:]
+    aoi = "--aoi" in sys.argv[1:]
+    behind = CATCH_UP
+    stats_port = None
+    rooms = 0
+    room_capacity = ROOM_CAPACITY
+    for arg in sys.argv[1:]:
+        # --behind=catch-up|skip|merge picks how the tick loop recovers from overruns
+        if arg.startswith("--behind="):
+            behind = arg.split("=", 1)[1]
+            if behind not in BEHIND_POLICIES:
+                sys.exit(f"--behind must be one of {', '.join(BEHIND_POLICIES)}")
+        # --stats-port=N serves the metrics as plaintext and JSON on localhost
+        if arg.startswith("--stats-port="):
+            stats_port = int(arg.split("=", 1)[1])
+        # --rooms[=N] splits players over N room processes (default one per
+        # core) behind a lobby; --room-capacity=N caps players per room
+        if arg == "--rooms" or arg.startswith("--rooms="):
+            rooms = int(arg.split("=", 1)[1]) if "=" in arg else os.cpu_count()
+        if arg.startswith("--room-capacity="):
+            room_capacity = int(arg.split("=", 1)[1])
+    if rooms and ("--udp" in sys.argv[1:] or "--asyncio" in sys.argv[1:]):
+        sys.exit("--rooms only works with the threaded TCP server")
+    if stats_port and not rooms:
+        serve_stats(metrics, stats_port)
+    if rooms:
+        # each room serves its own metrics on stats_port + room id
+        serve_rooms(rooms, room_capacity, push, delta, aoi, behind, stats_port)
+    elif "--udp" in sys.argv[1:]:
+        game_loop(udp=serve_udp(link_options(sys.argv[1:])), behind=behind)
+    elif "--asyncio" in sys.argv[1:]:
+        asyncio.run(serve_async(push, delta, aoi, behind))
+    else:
+        Thread(target=accept_connections, args=(push, delta, aoi), daemon=True).start()
+        game_loop(push, behind=behind)
@@ -1,14 +1,20 @@
+import os
 import socket
+import sys
 
 from graphics_engine import PyGameGraphicsEngine
 from input_controller import PyGameInputController
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from game7_protocol import FrameReader, decode_state, encode_actions, send_frame
+
 HOST = '127.0.0.1'
 PORT = 21001
 
 with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
     s.connect((HOST, PORT))
     print("Connected to server")
+    reader = FrameReader(s)
 
     graph_engine = PyGameGraphicsEngine(600, 600)
     input_controller = PyGameInputController()
@@ -30,21 +36,21 @@ with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             break
 
         print("Sending actions...", actions)
-        s.send(str(actions).encode())
+        send_frame(s, encode_actions(actions))
 
         print("Waiting for state...")
-        state_data = s.recv(1024)
-        state = eval(state_data.decode())
+        state_data = reader.read_frame()
+        if state_data is None:
+            break
+        state = decode_state(state_data)
 
-        # {1: (97, 3), 'self': 1}
+        # {'self': 1, 'players': [{'id': 1, 'x': 97.0, 'y': 3.0, 'score': 0}], 'npcs': []}
         print("State received:", state)
 
         graph_engine.start_frame()
 
-        for player_id, positions in state.items():
-            if player_id == "self":
-                continue
-            graph_engine.render_circle(positions[0], positions[1], 20, "green" if player_id == state["self"] else "blue")
+        for p in state["players"]:
+            graph_engine.render_circle(p["x"], p["y"], 20, "green" if p["id"] == state["self"] else "blue")
 
         graph_engine.show_frame()
 
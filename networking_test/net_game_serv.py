@@ -1,31 +1,35 @@
+import os
 import socket
+import sys
 from threading import Thread
 
 from characters import Player, NPC
 from game_field import GameField
 from server_game_engine import ServerGameEngine
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from game7_protocol import FrameReader, decode_actions, encode_state, send_frame
+
 connected_clients_number = 0
 
 
 def player_data_exchange(conn, player_id, game_engine):
+    reader = FrameReader(conn)
     while True:
         # print("Waiting for player actions...")
         try:
-            player_actions_data = conn.recv(1024)
-            if not player_actions_data:
+            player_actions_data = reader.read_frame()
+            if player_actions_data is None:
                 print("Player disconnected")
                 break
 
-            player_actions = eval(player_actions_data.decode())
+            player_actions = decode_actions(player_actions_data)
             # print("Player actions received", player_actions)
             game_engine.set_player_actions(player_id, player_actions)
 
             game_state_data = game_engine.get_game_state_data()
-            game_engine.set_player_actions(player_id, player_actions_data.decode())
-
-            game_state_data["self"] = player_id
-            conn.sendall(str(game_state_data).encode())
+            players = [(pid, x, y, 0, 0) for pid, (x, y) in game_state_data.items()]
+            send_frame(conn, encode_state(player_id, players, []))
             # print("State sent to player")
         except Exception as e:
             print(f"Error exchanging data: {e}")
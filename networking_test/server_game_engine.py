@@ -1,22 +1,27 @@
 import math
-import time
+import os
+import sys
 import random
 
 from bullet import Bullet
 from characters import NPC
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from tick_scheduler import CATCH_UP, TickScheduler
+
 
 def colliderect(rect1, rect2):
     return rect1[0] < rect2[2] and rect1[2] > rect2[0] and rect1[1] < rect2[3] and rect1[3] > rect2[1]
 
 
 class ServerGameEngine:
-    def __init__(self, game_field, players, npcs, *, fps=60):
+    def __init__(self, game_field, players, npcs, *, fps=60, behind=CATCH_UP):
 
         self.game_field = game_field
         self.players = players
         self.npcs = npcs
         self.fps = fps
+        self.behind = behind
         self.bullets = []
         self.actions_for_players = {}
 
@@ -45,29 +50,33 @@ class ServerGameEngine:
                 return idx
         return None
 
-    def update_state(self, actions_for_players):
-        for npc in self.npcs:
-            npc.move(self.game_field)
+    def update_state(self, actions_for_players, tick, dt):
+        # dt covers several frames when the scheduler merges missed ticks
+        for _ in range(max(1, round(dt * self.fps))):
+            for npc in self.npcs:
+                npc.move(self.game_field)
 
-        for p in self.players:
-            player_actions = actions_for_players[p.id] if p.id in actions_for_players else {}
+            for p in self.players:
+                player_actions = actions_for_players[p.id] if p.id in actions_for_players else {}
 
-            p.move("left" in player_actions,
-                   "right" in player_actions,
-                   "up" in player_actions,
-                   "down" in player_actions,
-                   False, self.game_field)
+                p.move("left" in player_actions,
+                       "right" in player_actions,
+                       "up" in player_actions,
+                       "down" in player_actions,
+                       False, self.game_field)
 
     def run_game(self):
         self.running = True
+        scheduler = TickScheduler(self.fps, self.behind)
 
         while self.running:
-            self.update_state(self.actions_for_players)
+            tick, dt = scheduler.wait()
+            if scheduler.lateness >= scheduler.interval:
+                print(f"tick {tick} started {scheduler.lateness * 1e3:.1f} ms late; {scheduler.stats()}")
+            self.update_state(self.actions_for_players, tick, dt)
 
             for p in self.players:
                 print(p.x, p.y)
 
             if len(self.players) == 0:
                 print("no players")
-
-            time.sleep(1 / self.fps)
@@ -0,0 +1,50 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import game7_server
+from game7_server import TICK_INTERVAL, GameState
+
+RIGHT = {"right": 1}
+
+
+def make_state(count):
+    game_state = GameState()
+    pids = [game_state.add_player() for _ in range(count)]
+    game_state.update(0, TICK_INTERVAL)
+    for pid in pids:
+        game_state.players[pid].x, game_state.players[pid].y = 100, 300
+    game_state.npcs = []
+    game_state.last_npc_spawn = float("inf")
+    return game_state, pids
+
+
+def run(game_state, ticks, send):
+    seqs = {pid: 0 for pid in game_state.players}
+    for tick in range(1, ticks + 1):
+        for pid, count in send(tick).items():
+            for _ in range(count):
+                seqs[pid] += 1
+                game_state.queue_command(pid, RIGHT, seqs[pid])
+        game_state.update(tick, TICK_INTERVAL)
+
+
+def test_flooding_client_moves_no_farther_than_honest_one():
+    game_state, (honest, flooder) = make_state(2)
+    run(game_state, 20, lambda tick: {honest: 1, flooder: 4})
+    assert game_state.players[flooder].x <= game_state.players[honest].x == 100 + 20 * 5
+
+
+def test_late_commands_catch_up_after_a_gap():
+    # a client whose commands stall for two ticks and then arrive together
+    # ends up where a steady client is, within the credit it banked
+    game_state, (steady, jittery) = make_state(2)
+    run(game_state, 20, lambda tick: {steady: 1, jittery: 0 if tick in (5, 6) else 3 if tick == 7 else 1})
+    assert game_state.players[jittery].x == game_state.players[steady].x
+
+
+def test_credit_is_capped():
+    game_state, (pid,) = make_state(1)
+    run(game_state, 1, lambda tick: {pid: 1})
+    run(game_state, 30, lambda tick: {})
+    assert game_state.command_credit[pid] == game7_server.MAX_COMMAND_CREDIT
@@ -0,0 +1,71 @@
+import asyncio
+import time
+
+# what to do once the loop has fallen a whole tick or more behind
+CATCH_UP = "catch-up"  # run the missed ticks back to back
+SKIP = "skip"  # drop the missed ticks and carry on from now
+MERGE = "merge"  # run the missed ticks as one longer step with a single dt
+BEHIND_POLICIES = (CATCH_UP, SKIP, MERGE)
+# ticks that catch-up and merge will make up for; anything older is dropped
+MAX_CATCHUP_STEPS = 5
+
+
+class TickScheduler:
+    # ticks are due at fixed monotonic deadlines start + n * interval, so
+    # time spent in the update is absorbed by a shorter sleep instead of
+    # pushing every later tick back
+    def __init__(self, rate, behind=CATCH_UP, max_catchup_steps=MAX_CATCHUP_STEPS):
+        if behind not in BEHIND_POLICIES:
+            raise ValueError(f"unknown behind policy {behind!r}")
+        self.interval = 1 / rate
+        self.behind = behind
+        self.max_catchup_steps = max_catchup_steps
+        self.deadline = None
+        self.tick = 0
+        self.lateness = 0.0
+        self.max_lateness = 0.0
+        self.overruns = 0
+        self.skipped = 0
+        self.merged = 0
+
+    def delay(self):
+        now = time.monotonic()
+        if self.deadline is None:
+            self.deadline = now
+        return max(0.0, self.deadline - now)
+
+    def start_tick(self):
+        # call once delay() has elapsed; returns (tick, dt) for the update
+        self.lateness = time.monotonic() - self.deadline
+        self.max_lateness = max(self.max_lateness, self.lateness)
+        missed = int(self.lateness / self.interval)
+        steps = 1
+        if missed:
+            self.overruns += 1
+            if self.behind == CATCH_UP:
+                # later deadlines are already due, so the next ticks run
+                # without sleeping until the loop is back on schedule
+                dropped = max(0, missed - self.max_catchup_steps)
+            elif self.behind == MERGE:
+                steps += min(missed, self.max_catchup_steps)
+                self.merged += steps - 1
+                dropped = missed - (steps - 1)
+            else:
+                dropped = missed
+            self.skipped += dropped
+            self.deadline += dropped * self.interval
+        self.deadline += steps * self.interval
+        self.tick += steps
+        return self.tick, steps * self.interval
+
+    def wait(self):
+        time.sleep(self.delay())
+        return self.start_tick()
+
+    async def wait_async(self):
+        await asyncio.sleep(self.delay())
+        return self.start_tick()
+
+    def stats(self):
+        return (f"Ticks: {self.tick} run, {self.overruns} overruns, {self.skipped} skipped, {self.merged} merged, "
+                f"max lateness {self.max_lateness * 1e3:.2f} ms ({self.behind})")